@@ -1,14 +1,25 @@
 from flask import Flask, render_template, request, jsonify, Response, stream_with_context, redirect, session
-from sqlalchemy import create_engine, text
-from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text, bindparam
+from datetime import datetime, timedelta, date
 import os
 import csv
 import io
-from decimal import Decimal
+from decimal import Context, Decimal, Inexact, InvalidOperation
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import jwt
 import time
-from functools import wraps
+import threading
+import queue
+import sqlite3
+import json
+import base64
+import hashlib
+import zlib
+import tempfile
+from functools import wraps, lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from flask_wtf import CSRFProtect
 from flask_wtf.csrf import CSRFError
 
@@ -28,8 +39,6 @@ app.config.update(
 )
 app.config["PREFERRED_URL_SCHEME"] = "https"
 
-last_button_press = None
-
 if app.debug:
     conn_str = os.getenv('VejmanKassenSQLTEST')
 else:
@@ -57,7 +66,7 @@ def login_required(f):
         # Production
         if "user" not in session:
             next_url = request.url
-            login_url = f"https://pyorchestrator.aarhuskommune.dk/api/auth/login?next={next_url}"
+            login_url = f"{PYORCHESTRATOR_BASE_URL}/api/auth/login?next={next_url}"
             return redirect(login_url)
 
         return f(*args, **kwargs)
@@ -82,8 +91,27 @@ def role_required(*roles):
     return decorator
 
 
-def log_action(conn, *, row_id, action_type, old, new, user_email):
-    sql = text("""
+# VejmanFaktureringLog columns, in the order audit inserts use
+LOG_COLUMNS = (
+    'RowID', 'ActionType',
+    'OldMeter', 'NewMeter',
+    'OldStartdato', 'NewStartdato',
+    'OldSlutdato', 'NewSlutdato',
+    'OldStatus', 'NewStatus',
+    'PerformedBy',
+)
+
+@lru_cache(maxsize=None)
+def audited_update_sql(set_clause, where_clause, returning="SELECT * FROM #changed"):
+    """One batch that UPDATEs VejmanFakturering and writes a VejmanFaktureringLog
+    row per changed row from the UPDATE's OUTPUT, then runs `returning`, which
+    can read the changed IDs and old/new values from #changed.
+    Binds :action and :user plus whatever the clauses use.
+
+    With the audit queue enabled the INSERT is left out; callers hand the
+    #changed values to audit_queue.record() after commit instead.
+    """
+    log_insert = "" if AUDIT_QUEUE_ENABLED else """
         INSERT INTO VejmanFaktureringLog (
             RowID, ActionType,
             OldMeter, NewMeter,
@@ -92,36 +120,46 @@ def log_action(conn, *, row_id, action_type, old, new, user_email):
             OldStatus, NewStatus,
             PerformedBy
         )
-        VALUES (
-            :RowID, :ActionType,
-            :OldMeter, :NewMeter,
-            :OldStartdato, :NewStartdato,
-            :OldSlutdato, :NewSlutdato,
-            :OldStatus, :NewStatus,
-            :PerformedBy
-        )
-    """)
-
-    conn.execute(sql, {
-        "RowID": row_id,
-        "ActionType": action_type,
-
-        "OldMeter": old.get("Meter"),
-        "NewMeter": new.get("Meter"),
-        "OldStartdato": old.get("Startdato"),
-        "NewStartdato": new.get("Startdato"),
-        "OldSlutdato": old.get("Slutdato"),
-        "NewSlutdato": new.get("Slutdato"),
-
-        "OldStatus": old.get("FakturaStatus"),
-        "NewStatus": new.get("FakturaStatus"),
+        SELECT ID, :action,
+               OldMeter, NewMeter,
+               OldStartdato, NewStartdato,
+               OldSlutdato, NewSlutdato,
+               OldStatus, NewStatus,
+               :user
+        FROM #changed;
+    """
+    return text(f"""
+        SET NOCOUNT ON;
+        -- Same column types as VejmanFakturering, so the log gets the values unchanged.
+        -- A pooled connection may still hold the table from an earlier (failed) batch.
+        IF OBJECT_ID('tempdb..#changed') IS NOT NULL DROP TABLE #changed;
+        SELECT TOP 0
+               ID + 0 AS ID,   -- an expression, so the IDENTITY property is not copied
+               Meter AS OldMeter, Meter AS NewMeter,
+               Startdato AS OldStartdato, Startdato AS NewStartdato,
+               Slutdato AS OldSlutdato, Slutdato AS NewSlutdato,
+               FakturaStatus AS OldStatus, FakturaStatus AS NewStatus
+        INTO #changed
+        FROM [dbo].[VejmanFakturering];
 
-        "PerformedBy": user_email
-    })
+        UPDATE [dbo].[VejmanFakturering]
+        SET {set_clause}
+        OUTPUT inserted.ID,
+               deleted.Meter, inserted.Meter,
+               deleted.Startdato, inserted.Startdato,
+               deleted.Slutdato, inserted.Slutdato,
+               deleted.FakturaStatus, inserted.FakturaStatus
+        INTO #changed
+        WHERE {where_clause};
+        {log_insert}
+        {returning};
+    """)
 
 
 # --- Helpers ---
 def fmt_date(d):
+    if isinstance(d, date):
+        return d.strftime('%d-%m-%Y')
     try:
         return datetime.strptime(str(d), '%Y-%m-%d').strftime('%d-%m-%Y')
     except Exception:
@@ -133,6 +171,8 @@ def fmt_date(d):
 
 def fmt_date_iso(d):
     """Helper to ISO (yyyy-mm-dd) for <input type='date'>."""
+    if isinstance(d, date):
+        return d.strftime('%Y-%m-%d')
     try:
         return datetime.strptime(str(d), '%Y-%m-%d').strftime('%Y-%m-%d')
     except Exception:
@@ -161,6 +201,44 @@ def parse_number_to_float(s):
     """Parse '1,23' or '1.23' to float or raise."""
     return float(str(s).replace(',', '.'))
 
+class TTLCache:
+    """Small thread-safe in-process cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.maxsize:
+                for k in [k for k, (exp, _) in self._data.items() if exp < now]:
+                    del self._data[k]
+                if len(self._data) >= self.maxsize:
+                    self._data.pop(next(iter(self._data)))
+            self._data[key] = (now + (self.ttl if ttl is None else ttl), value)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
 # Allowed columns for sorting from the UI -> map to DB columns
 SORTABLE_COLUMNS = {
     'Ansøger': 'Ansøger',
@@ -178,6 +256,624 @@ SORTABLE_COLUMNS = {
     'Ordrenummer': 'Ordrenummer'
 }
 
+# ------------------------- PyOrchestrator client -------------------------
+#
+# All calls to PyOrchestrator go through one pooled requests.Session, so TLS
+# connections are reused between requests. Idempotent GETs are retried with
+# jittered exponential backoff on connection errors and 502/503/504; POSTs are
+# never retried. After repeated failures a circuit breaker fails calls fast
+# for a while instead of letting each one hold a Waitress thread until timeout.
+
+PYORCHESTRATOR_BASE_URL = (os.getenv("PyOrchestratorBaseURL") or "https://pyorchestrator.aarhuskommune.dk").rstrip('/')
+PYORCHESTRATOR_TIMEOUT = (3.05, 10)     # (connect, read) seconds
+PYORCHESTRATOR_POOL_SIZE = 10
+PYORCHESTRATOR_GET_RETRIES = 2
+PYORCHESTRATOR_BREAKER_FAILURES = 5     # consecutive failures before opening
+PYORCHESTRATOR_BREAKER_SECONDS = 30     # how long the breaker stays open
+
+class OrchestratorUnavailable(requests.exceptions.RequestException):
+    """Raised without a network call while the circuit breaker is open."""
+
+class PyOrchestratorClient:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        retry = Retry(
+            total=PYORCHESTRATOR_GET_RETRIES,
+            allowed_methods=frozenset({"GET"}),
+            status_forcelist=(502, 503, 504),
+            backoff_factor=0.3,
+            backoff_jitter=0.3,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PYORCHESTRATOR_POOL_SIZE, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def api_key(self):
+        return os.getenv("PyOrchestratorAPIKey")
+
+    def _check_breaker(self):
+        with self._lock:
+            if time.monotonic() < self._open_until:
+                raise OrchestratorUnavailable("PyOrchestrator svarer ikke, prøv igen om lidt")
+
+    def _record(self, ok):
+        with self._lock:
+            if ok:
+                self._failures = 0
+                self._open_until = 0.0
+                return
+            self._failures += 1
+            if self._failures >= PYORCHESTRATOR_BREAKER_FAILURES:
+                self._open_until = time.monotonic() + PYORCHESTRATOR_BREAKER_SECONDS
+
+    def request(self, method, path, *, timeout=None, headers=None, **kwargs):
+        """Call `{base_url}/api{path}` with the API key. Raises RequestException
+        (OrchestratorUnavailable while the breaker is open)."""
+        self._check_breaker()
+        headers = {"X-API-Key": self.api_key or "", **(headers or {})}
+        try:
+            resp = self._session.request(
+                method, f"{self.base_url}/api{path}",
+                headers=headers, timeout=timeout or PYORCHESTRATOR_TIMEOUT, **kwargs
+            )
+        except requests.exceptions.RequestException:
+            self._record(False)
+            raise
+        self._record(resp.status_code < 500)
+        return resp
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+orchestrator = PyOrchestratorClient(PYORCHESTRATOR_BASE_URL)
+# For issuing independent orchestrator GETs concurrently
+orchestrator_pool = ThreadPoolExecutor(max_workers=PYORCHESTRATOR_POOL_SIZE, thread_name_prefix="orchestrator")
+
+# ------------------------- List query engine -------------------------
+
+def _text_or_empty(v):
+    return v or ''
+
+def _str_or_empty(v):
+    return str(v or '')
+
+def _int_or_zero(v):
+    return v if v is not None else 0
+
+def _as_is(v):
+    return v
+
+# UI field -> (DB column, formatter) for rows returned by the list endpoints
+LIST_COLUMNS = {
+    'ID': ('ID', _as_is),
+    'VejmanID': ('VejmanID', _as_is),
+    'Ansøger': ('Ansøger', _text_or_empty),
+    'Adresse': ('FørsteSted', _text_or_empty),
+    'Tilladelsesnr': ('Tilladelsesnr', _text_or_empty),
+    'CvrNr': ('CvrNr', _text_or_empty),
+    'TilladelsesType': ('TilladelsesType', _text_or_empty),
+    'Enhedspris': ('Enhedspris', fmt_num),
+    'Meter': ('Meter', fmt_num),
+    'Startdato': ('Startdato', fmt_date),
+    'Slutdato': ('Slutdato', fmt_date),
+    'AntalDage': ('AntalDage', _int_or_zero),
+    'TotalPris': ('TotalPris', fmt_num),
+    'FakturaStatus': ('FakturaStatus', _text_or_empty),
+    'FakturaDato': ('FakturaDato', fmt_date),
+    'Ordrenummer': ('Ordrenummer', _as_is),
+    'PEZUUID': ('PEZUUID', _str_or_empty),
+}
+
+# Expressions matched by the search box
+SEARCH_COLUMNS = (
+    'Ansøger',
+    'FørsteSted',
+    'Tilladelsesnr',
+    'CONVERT(varchar(20), CvrNr)',
+    'TilladelsesType',
+)
+
+_OPEN_LIST_FIELDS = (
+    'ID', 'VejmanID', 'Ansøger', 'Adresse', 'Tilladelsesnr', 'CvrNr', 'TilladelsesType',
+    'Enhedspris', 'Meter', 'Startdato', 'Slutdato', 'AntalDage', 'TotalPris',
+    'FakturaStatus', 'PEZUUID',
+)
+
+# Declarative list views served by run_list_view()
+LIST_VIEWS = {
+    'ikkefaktureret': {
+        'base_where': "FakturaStatus = 'Ny'",
+        'fields': _OPEN_LIST_FIELDS,
+        'search': SEARCH_COLUMNS,
+        'sortable': SORTABLE_COLUMNS,
+    },
+    'tilfakturering': {
+        'base_where': "FakturaStatus = 'Afsendt'",
+        'fields': _OPEN_LIST_FIELDS,
+        'search': SEARCH_COLUMNS,
+        'sortable': SORTABLE_COLUMNS,
+    },
+    'faktureret': {
+        'base_where': "FakturaStatus = 'Faktureret'",
+        'fields': (
+            'ID', 'VejmanID', 'Ansøger', 'Adresse', 'Tilladelsesnr', 'CvrNr', 'TilladelsesType',
+            'Startdato', 'Slutdato', 'TotalPris', 'FakturaDato', 'Ordrenummer', 'PEZUUID',
+        ),
+        'search': SEARCH_COLUMNS + ('CONVERT(varchar(20), Ordrenummer)',),
+        'sortable': SORTABLE_COLUMNS,
+        'keyset': True,
+    },
+    'statistik': {
+        'base_where': None,
+        'fields': _OPEN_LIST_FIELDS,
+        'search': SEARCH_COLUMNS,
+        'sortable': SORTABLE_COLUMNS,
+        'keyset': True,
+    },
+}
+
+# Precompute SELECT list and (field, position, formatter) table per view
+for _view in LIST_VIEWS.values():
+    _view['select'] = ",\n            ".join(LIST_COLUMNS[f][0] for f in _view['fields'])
+    _view['formatters'] = tuple(
+        (f, idx, LIST_COLUMNS[f][1]) for idx, f in enumerate(_view['fields'])
+    )
+
+def _search_sql(columns):
+    return "(" + " OR ".join(f"{c} LIKE :q" for c in columns) + ")"
+
+def search_filter(search, columns):
+    """Return (mode, clause, params) for a search string.
+
+    mode is 'ids' when the search index resolved the string to matching IDs
+    (clause uses the expanding :ids parameter, see with_ids), 'none' when the
+    index knows there are no matches, and 'like' for the LIKE fallback.
+    """
+    ids = search_index.resolve(search, columns)
+    if ids is None:
+        return 'like', _search_sql(columns), {'q': f"%{search}%"}
+    if not ids:
+        return 'none', "1=0", {}
+    return 'ids', "ID IN :ids", {'ids': sorted(ids)}
+
+def with_ids(stmt, params):
+    """Mark :ids as an expanding IN parameter when a search resolved to IDs."""
+    if 'ids' in params:
+        return stmt.bindparams(bindparam('ids', expanding=True))
+    return stmt
+
+@lru_cache(maxsize=256)
+def _compile_list_sql(view_name, sort_col, order, search_mode, extra_where):
+    """Build (count_sql, data_sql, windowed_sql) once per view/sort/search/filter shape."""
+    view = LIST_VIEWS[view_name]
+    clauses = []
+    if view['base_where']:
+        clauses.append(view['base_where'])
+    clauses.extend(extra_where)
+    if search_mode == 'like':
+        clauses.append(_search_sql(view['search']))
+    elif search_mode == 'ids':
+        clauses.append("ID IN :ids")
+    where_all = " AND ".join(clauses) if clauses else "1=1"
+
+    # Keyset views also return the raw sort value for building the next cursor
+    select = view['select']
+    if view.get('keyset'):
+        select += f",\n            {sort_col} AS _sort"
+
+    count_sql = text(f"""
+        SELECT COUNT(*) AS cnt
+        FROM [dbo].[VejmanFakturering]
+        WHERE {where_all}
+    """)
+
+    data_sql = text(f"""
+        SELECT
+            {select}
+        FROM [dbo].[VejmanFakturering]
+        WHERE {where_all}
+        ORDER BY {sort_col} {order}, ID {order}
+        OFFSET :offset ROWS
+        FETCH NEXT :limit ROWS ONLY
+    """)
+
+    # Same page plus the filtered total in one statement
+    windowed_sql = text(f"""
+        SELECT
+            {select},
+            COUNT(*) OVER () AS _total
+        FROM [dbo].[VejmanFakturering]
+        WHERE {where_all}
+        ORDER BY {sort_col} {order}, ID {order}
+        OFFSET :offset ROWS
+        FETCH NEXT :limit ROWS ONLY
+    """)
+    if search_mode == 'ids':
+        count_sql, data_sql, windowed_sql = (
+            s.bindparams(bindparam('ids', expanding=True)) for s in (count_sql, data_sql, windowed_sql)
+        )
+    return count_sql, data_sql, windowed_sql
+
+# Totals reused across page flips when a list is requested with count=cached
+LIST_TOTAL_TTL = 30
+list_total_cache = TTLCache(ttl=LIST_TOTAL_TTL)
+
+def fetch_page(conn, statements, params, offset, limit, count_mode='window', cache_key=None):
+    """Fetch one page and the filtered total.
+
+    count_mode='window' reads the total from the COUNT(*) OVER () column of the
+    page query (one statement). count_mode='cached' additionally reuses a total
+    from list_total_cache for the same filter, so page flips only run the page query.
+    The windowed statement must return the total as its last column.
+    """
+    count_sql, data_sql, windowed_sql = statements
+    page_params = {**params, 'offset': offset, 'limit': limit}
+
+    if count_mode == 'cached' and cache_key is not None:
+        total = list_total_cache.get(cache_key)
+        if total is not None:
+            return total, conn.execute(data_sql, page_params).all()
+
+    rows = conn.execute(windowed_sql, page_params).all()
+    if rows:
+        total = rows[0][-1]
+    elif offset > 0:
+        # Paged past the end: the window is empty, so count separately
+        total = conn.execute(count_sql, params).scalar()
+    else:
+        total = 0
+
+    if cache_key is not None:
+        list_total_cache.set(cache_key, total)
+    return total, rows
+
+def _count_mode(args):
+    return 'cached' if (args.get('count') or '').strip().lower() == 'cached' else 'window'
+
+def _list_args(args, sortable):
+    """Read bootstrap-table pagination/search/sort args."""
+    try:
+        limit = int(args.get('limit', 10))
+    except Exception:
+        limit = 10
+    try:
+        offset = int(args.get('offset', 0))
+    except Exception:
+        offset = 0
+
+    search = (args.get('search') or '').strip()
+    sort_ui = (args.get('sort') or 'Ansøger').strip()
+    order = (args.get('order') or 'asc').upper()
+    order = 'DESC' if order.lower() == 'desc' else 'ASC'
+    sort_col = sortable.get(sort_ui, 'Ansøger')
+    return limit, offset, search, sort_col, order
+
+# ---- Keyset (seek) pagination ----
+#
+# Keyset views return an opaque `cursor` for the row after the current page.
+# When the client sends it back together with the matching offset (i.e. it is
+# moving to the next page of the same sort/filter), the page is read with a
+# seek predicate on (sort_col, ID) instead of OFFSET. Any other request falls
+# back to the normal offset contract.
+
+def _encode_sort_value(v):
+    if isinstance(v, datetime):
+        return ['t', v.isoformat()]
+    if isinstance(v, date):
+        return ['d', v.isoformat()]
+    if isinstance(v, Decimal):
+        return ['n', str(v)]
+    return ['v', v]
+
+def _decode_sort_value(tag, v):
+    if tag == 't':
+        return datetime.fromisoformat(v)
+    if tag == 'd':
+        return date.fromisoformat(v)
+    if tag == 'n':
+        return Decimal(v)
+    return v
+
+def _cursor_signature(view_name, sort_col, order, cache_key):
+    return hashlib.sha1(repr((view_name, sort_col, order, cache_key)).encode('utf-8')).hexdigest()[:16]
+
+def encode_cursor(signature, offset, sort_value, row_id):
+    raw = json.dumps([signature, offset, *_encode_sort_value(sort_value), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, signature, offset):
+    """Return (sort_value, row_id) if the cursor belongs to this sort/filter and offset, else None."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sig, cur_offset, tag, value, row_id = json.loads(raw)
+        if sig != signature or cur_offset != offset:
+            return None
+        return _decode_sort_value(tag, value), int(row_id)
+    except Exception:
+        return None
+
+def _seek_sql(sort_col, order, value_is_null):
+    """Rows after (k_val, k_id) in ORDER BY sort_col, ID (SQL Server sorts NULLs first)."""
+    if order == 'ASC':
+        if value_is_null:
+            return f"({sort_col} IS NOT NULL OR ({sort_col} IS NULL AND ID > :k_id))"
+        return f"({sort_col} > :k_val OR ({sort_col} = :k_val AND ID > :k_id))"
+    if value_is_null:
+        return f"({sort_col} IS NULL AND ID < :k_id)"
+    return f"({sort_col} < :k_val OR ({sort_col} = :k_val AND ID < :k_id) OR {sort_col} IS NULL)"
+
+def run_list_view(view_name, args, extra_where=(), extra_params=None):
+    """Run a LIST_VIEWS query for bootstrap-table and return {'total', 'rows'}.
+    extra_where/extra_params add view-specific filters (e.g. Statistik).
+    Pass count=cached to reuse the total across page flips of the same filter.
+    Keyset views also accept/return `cursor` (see encode_cursor).
+    """
+    view = LIST_VIEWS[view_name]
+    limit, offset, search, sort_col, order = _list_args(args, view['sortable'])
+
+    extra_params = dict(extra_params or {})
+    extra_where = tuple(extra_where)
+    cache_key = (view_name, extra_where, tuple(sorted(extra_params.items())), search)
+
+    params = dict(extra_params)
+    search_mode = None
+    if search:
+        search_mode, _, search_params = search_filter(search, view['search'])
+        if search_mode == 'none':
+            return {'total': 0, 'rows': []}
+        params.update(search_params)
+
+    statements = _compile_list_sql(view_name, sort_col, order, search_mode, extra_where)
+
+    keyset = view.get('keyset', False)
+    seek = None
+    if keyset:
+        signature = _cursor_signature(view_name, sort_col, order, cache_key)
+        cursor = (args.get('cursor') or '').strip()
+        if cursor and offset > 0:
+            seek = decode_cursor(cursor, signature, offset)
+
+    engine = get_connection()
+    with engine.begin() as conn:
+        if seek is None:
+            total, rows = fetch_page(conn, statements, params, offset, limit,
+                                     count_mode=_count_mode(args), cache_key=cache_key)
+        else:
+            k_val, k_id = seek
+            seek_where = extra_where + (_seek_sql(sort_col, order, k_val is None),)
+            _, seek_data_sql, _ = _compile_list_sql(view_name, sort_col, order, search_mode, seek_where)
+            total = list_total_cache.get(cache_key)
+            if total is None:
+                total = conn.execute(statements[0], params).scalar()
+                list_total_cache.set(cache_key, total)
+            rows = conn.execute(seek_data_sql, {**params, 'k_val': k_val, 'k_id': k_id,
+                                                'offset': 0, 'limit': limit}).all()
+
+    formatters = view['formatters']
+    out = [{field: fn(r[idx]) for field, idx, fn in formatters} for r in rows]
+    result = {'total': total, 'rows': out}
+
+    if keyset and len(rows) == limit and offset + limit < total:
+        last = rows[-1]
+        sort_idx = len(view['fields'])
+        result['cursor'] = encode_cursor(signature, offset + limit, last[sort_idx], last[0])
+    return result
+
+# ------------------------- Sync state -------------------------
+#
+# Latest VejmanKassenSyncHistory.SyncedAt, shared by the navbar, /api/sync/last
+# and the caches that rebuild after a sync. The value is kept for a short TTL;
+# once it expires the stale value is still served while one background thread
+# re-reads it, so page renders never wait on the database after the first load.
+
+SYNC_STATE_TTL = 15   # seconds
+
+class SyncState:
+    def __init__(self):
+        self._synced_at = None
+        self._loaded = False
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def _fetch(self):
+        engine = get_connection()
+        with engine.begin() as conn:
+            synced_at = conn.execute(text("SELECT MAX(SyncedAt) FROM VejmanKassenSyncHistory")).scalar()
+        with self._lock:
+            self._synced_at = synced_at
+            self._loaded = True
+            self._fetched_at = time.monotonic()
+        return synced_at
+
+    def _refresh(self):
+        try:
+            self._fetch()
+        except Exception as e:
+            print("Error refreshing sync state:", e)
+        finally:
+            self._refreshing.release()
+
+    def refresh(self):
+        """Re-read the timestamp now, in the calling thread."""
+        return self._fetch()
+
+    def invalidate(self):
+        """Force the next read to go to the database."""
+        with self._lock:
+            self._fetched_at = 0.0
+
+    def synced_at(self):
+        """Latest SyncedAt (datetime or None). Raises only if it has never been read."""
+        with self._lock:
+            loaded, synced_at, age = self._loaded, self._synced_at, time.monotonic() - self._fetched_at
+        if not loaded:
+            return self._fetch()
+        if age > SYNC_STATE_TTL and self._refreshing.acquire(blocking=False):
+            threading.Thread(target=self._refresh, name="sync-state-refresh", daemon=True).start()
+        return synced_at
+
+    def display(self):
+        try:
+            synced_at = self.synced_at()
+        except Exception as e:
+            print("Error fetching sync time:", e)
+            return "Fejl ved hentning"
+        if synced_at:
+            return synced_at.strftime('%d-%m-%Y %H:%M:%S')
+        return "Ukendt tidspunkt"
+
+sync_state = SyncState()
+
+def _latest_sync_at():
+    return sync_state.synced_at()
+
+# ------------------------- Search index -------------------------
+#
+# In-process trigram index over the search box columns of VejmanFakturering.
+# A search string is resolved to matching IDs in Python, so list and metrics
+# queries filter on ID instead of scanning with LIKE '%q%'. The index is built
+# in the background on first use and refreshed after each sync (a new
+# VejmanKassenSyncHistory.SyncedAt); a refresh re-reads the narrow search
+# projection and only re-indexes rows whose text changed. Until the index is
+# ready, and for strings it cannot answer, callers fall back to LIKE.
+
+# Every expression any list view searches; views verify against their own subset
+SEARCH_INDEX_COLUMNS = SEARCH_COLUMNS + ('CONVERT(varchar(20), Ordrenummer)',)
+SEARCH_INDEX_CHECK_INTERVAL = 30      # seconds between sync checks
+SEARCH_INDEX_MAX_AGE = 3600           # full re-read even without a new sync
+SEARCH_INDEX_MAX_IDS = 2000           # above this, LIKE is used (SQL Server parameter limit)
+
+def _trigrams(s):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+class TrigramIndex:
+    def __init__(self, columns):
+        self.columns = columns
+        self._docs = {}        # ID -> tuple of lower-cased column values
+        self._postings = {}    # trigram -> set of IDs
+        self._ready = False
+        self._synced_at = None
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def _add(self, row_id, doc):
+        postings = self._postings
+        for value in doc:
+            for tg in _trigrams(value):
+                postings.setdefault(tg, set()).add(row_id)
+
+    def _remove(self, row_id, doc):
+        postings = self._postings
+        for value in doc:
+            for tg in _trigrams(value):
+                ids = postings.get(tg)
+                if ids is not None:
+                    ids.discard(row_id)
+                    if not ids:
+                        del postings[tg]
+
+    def refresh(self):
+        """Re-read the search projection and apply the differences to the index."""
+        if not self._refreshing.acquire(blocking=False):
+            return
+        try:
+            synced_at = _latest_sync_at()
+            sql = text(f"""
+                SELECT ID, {', '.join(self.columns)}
+                FROM [dbo].[VejmanFakturering]
+            """)
+            engine = get_connection()
+            with engine.connect() as conn:
+                result = conn.execution_options(stream_results=True).execute(sql)
+                fresh = {r[0]: tuple('' if v is None else str(v).lower() for v in r[1:])
+                         for r in result}
+
+            with self._lock:
+                docs = self._docs
+                for row_id in [i for i in docs if i not in fresh]:
+                    self._remove(row_id, docs.pop(row_id))
+                for row_id, doc in fresh.items():
+                    old = docs.get(row_id)
+                    if old == doc:
+                        continue
+                    if old is not None:
+                        self._remove(row_id, old)
+                    docs[row_id] = doc
+                    self._add(row_id, doc)
+                self._synced_at = synced_at
+                self._built_at = time.monotonic()
+                self._ready = True
+        except Exception as e:
+            print("Error refreshing search index:", e)
+        finally:
+            self._refreshing.release()
+
+    def _refresh_in_background(self):
+        if self._refreshing.locked():
+            return
+        threading.Thread(target=self.refresh, name="search-index-refresh", daemon=True).start()
+
+    def _check_fresh(self):
+        now = time.monotonic()
+        if not self._ready:
+            self._refresh_in_background()
+            return
+        if now - self._checked_at < SEARCH_INDEX_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            stale = (now - self._built_at > SEARCH_INDEX_MAX_AGE
+                     or _latest_sync_at() != self._synced_at)
+        except Exception:
+            stale = False
+        if stale:
+            self._refresh_in_background()
+
+    def resolve(self, search, columns):
+        """Return the set of IDs whose `columns` contain `search` (case-insensitive),
+        or None when the caller should fall back to LIKE."""
+        q = (search or '').strip().lower()
+        if len(q) < 3 or any(ch in q for ch in '%_['):
+            return None
+        self._check_fresh()
+        if not self._ready:
+            return None
+
+        positions = [self.columns.index(c) for c in columns]
+        with self._lock:
+            lists = []
+            for tg in _trigrams(q):
+                ids = self._postings.get(tg)
+                if not ids:
+                    return set()
+                lists.append(ids)
+            lists.sort(key=len)
+            candidates = set(lists[0])
+            for ids in lists[1:]:
+                candidates &= ids
+                if not candidates:
+                    return set()
+            docs = self._docs
+            matches = {i for i in candidates if any(q in docs[i][p] for p in positions)}
+
+        if len(matches) > SEARCH_INDEX_MAX_IDS:
+            return None
+        return matches
+
+search_index = TrigramIndex(SEARCH_INDEX_COLUMNS)
+
 # ------------------------- Pages -------------------------
 
 @app.route('/')
@@ -203,7 +899,14 @@ def statistik_page():
 @app.route('/konflikter')
 @login_required
 def konflikter_page():
-    return render_template('konflikter.html', page_title='Konflikter')
+    return render_template('konflikter.html', page_title='Konflikter',
+                           acceptable_types=ISSUE_ACCEPTABLE_TYPES)
+
+@app.route('/log')
+@login_required
+@role_required("Vejmankassen-Admin")
+def audit_log_page():
+    return render_template('audit.html', page_title='Log', audit_actions=AUDIT_ACTIONS)
 
 @app.route('/tilsyn')
 @login_required
@@ -224,8 +927,7 @@ def tilsyn_opret():
     email = user.get("email", "")
     initials = email.split("@")[0].upper() if email else "UNKNOWN"
 
-    api_key = os.getenv("PyOrchestratorAPIKey")
-    if not api_key:
+    if not orchestrator.api_key:
         return jsonify({"error": "API-nøgle mangler i miljøvariabler"}), 500
 
     payload = {
@@ -240,12 +942,9 @@ def tilsyn_opret():
     }
 
     try:
-        resp = requests.post(
-            "https://pyorchestrator.aarhuskommune.dk/api/tilsyn/indmeldt",
-            json=payload,
-            headers={"X-API-Key": api_key, "Content-Type": "application/json"},
-            timeout=15,
-        )
+        resp = orchestrator.post("/tilsyn/indmeldt", json=payload, timeout=(3.05, 15))
+        if resp.ok:
+            tilsyn_cache.clear()
         return jsonify(resp.json()), resp.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Netværksfejl: {str(e)}"}), 500
@@ -260,8 +959,7 @@ def tilsyn_inspicer():
     user = session.get("user", {})
     email = user.get("email", "")
 
-    api_key = os.getenv("PyOrchestratorAPIKey")
-    if not api_key:
+    if not orchestrator.api_key:
         return jsonify({"error": "API-n\u00f8gle mangler"}), 500
 
     payload = {
@@ -272,391 +970,386 @@ def tilsyn_inspicer():
     }
 
     try:
-        resp = requests.post(
-            "https://pyorchestrator.aarhuskommune.dk/api/tilsyn/inspect",
-            json=payload,
-            headers={"X-API-Key": api_key, "Content-Type": "application/json"},
-            timeout=15,
-        )
+        resp = orchestrator.post("/tilsyn/inspect", json=payload, timeout=(3.05, 15))
+        if resp.ok:
+            tilsyn_cache.clear()
         return jsonify(resp.json()), resp.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Netv\u00e6rksfejl: {str(e)}"}), 500
 
-@app.route('/tilsyn/data')
-@login_required
-def tilsyn_data():
-    """Proxy: fetch all tilsyn tasks + history from PyOrchestratorAPI and
-    return the combined list filtered to type=indmeldt."""
-    api_key = os.getenv("PyOrchestratorAPIKey")
-    if not api_key:
-        return jsonify({"error": "API-nøgle mangler"}), 500
-
-    base = "https://pyorchestrator.aarhuskommune.dk/api"
-    headers = {"X-API-Key": api_key}
-    items = []
-
-    try:
-        # Active (not yet inspected)
-        r1 = requests.get(f"{base}/tilsyn/tasks", headers=headers, timeout=15)
-        if r1.ok:
-            items += [i for i in r1.json() if i.get("type") == "indmeldt"]
-
-        # History (inspected / hidden)
-        r2 = requests.get(f"{base}/tilsyn/history", headers=headers, timeout=15)
-        if r2.ok:
-            items += [i for i in r2.json() if i.get("type") == "indmeldt"]
+# Merged tasks + history, shared by every caseworker for a short while and
+# dropped as soon as a tilsyn is created or inspected through this app.
+TILSYN_CACHE_TTL = 30
+tilsyn_cache = TTLCache(TILSYN_CACHE_TTL, maxsize=1)
+_tilsyn_fetch_lock = threading.Lock()
+
+TILSYN_PAGE_SIZE = 50
+TILSYN_MAX_PAGE_SIZE = 200
+
+def _indmeldt(resp):
+    return [i for i in resp.json() if i.get("type") == "indmeldt"] if resp.ok else None
+
+def fetch_tilsyn_items():
+    """Return (items, etag) for all indmeldt tilsyn, newest-created first.
+    Raises RequestException if PyOrchestrator cannot be reached."""
+    cached = tilsyn_cache.get('items')
+    if cached is not None:
+        return cached
+    with _tilsyn_fetch_lock:
+        cached = tilsyn_cache.get('items')
+        if cached is not None:
+            return cached
+
+        # Active (not yet inspected) and history (inspected / hidden), fetched concurrently
+        f_tasks = orchestrator_pool.submit(orchestrator.get, "/tilsyn/tasks")
+        f_history = orchestrator_pool.submit(orchestrator.get, "/tilsyn/history")
+        tasks, history = _indmeldt(f_tasks.result()), _indmeldt(f_history.result())
 
         # Deduplicate by id (an item could appear in both if race)
         seen = set()
         unique = []
-        for i in items:
+        for i in (tasks or []) + (history or []):
             if i["id"] not in seen:
                 seen.add(i["id"])
                 unique.append(i)
 
-        # Sort newest-created first
-        unique.sort(key=lambda x: x.get("created_at") or "", reverse=True)
-        return jsonify(unique)
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Netværksfejl: {str(e)}"}), 500
+        # Sort newest-created first (id breaks ties, so 'before' cursors are stable)
+        unique.sort(key=_tilsyn_key, reverse=True)
+
+        body = json.dumps(unique, sort_keys=True, default=str).encode('utf-8')
+        result = (unique, hashlib.sha1(body).hexdigest())
+        # A failed upstream call gives a partial list; serve it but don't keep it
+        if tasks is not None and history is not None:
+            tilsyn_cache.set('items', result)
+        return result
+
+def _tilsyn_key(item):
+    return (item.get("created_at") or "", str(item.get("id")))
+
+def tilsyn_status(item):
+    """'aktiv', 'inspiceret' or 'skjult' (same rules as tilsyn.html)."""
+    if item.get("hidden") is True:
+        return 'skjult'
+    if item.get("last_inspected_at"):
+        return 'inspiceret'
+    return 'aktiv'
+
+def _tilsyn_filter(args):
+    """Predicate for the /tilsyn/data filters in `args`."""
+    statuses = {v.strip().lower() for v in (args.get('status') or '').split(',') if v.strip()}
+    street = (args.get('street') or '').strip().lower()
+    created_by = (args.get('created_by') or '').strip().lower()
+    search = (args.get('search') or '').strip().lower()
+    created_from = (args.get('created_from') or '').strip()
+    created_to = (args.get('created_to') or '').strip()
+
+    def text_of(item, field):
+        return str(item.get(field) or '').lower()
+
+    def keep(item):
+        if statuses and tilsyn_status(item) not in statuses:
+            return False
+        if street and street not in text_of(item, 'street_name') and street not in text_of(item, 'full_address'):
+            return False
+        if created_by and text_of(item, 'created_by') != created_by:
+            return False
+        created_day = (item.get('created_at') or '')[:10]
+        if created_from and created_day < created_from:
+            return False
+        if created_to and created_day > created_to:
+            return False
+        if search and not any(search in text_of(item, f)
+                              for f in ('case_number', 'title', 'full_address', 'created_by')):
+            return False
+        return True
+    return keep
+
+def _encode_tilsyn_cursor(item):
+    return base64.urlsafe_b64encode(json.dumps(_tilsyn_key(item)).encode('utf-8')).decode('ascii')
+
+def _decode_tilsyn_cursor(cursor):
+    try:
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return (str(created_at), str(item_id))
+    except Exception:
+        raise ValueError("Ugyldig cursor")
 
-# ------------------------- API: Lists -------------------------
+def tilsyn_page_payload(items, args):
+    """Filter the merged list; return every matching active tilsyn and one page
+    of the closed history (inspiceret / skjult).
 
-@app.route('/api/ikkefaktureret')
-def ikkefaktureret_data():
-    """Server-side endpoint for the 'Ikke faktureret' view.
-    New logic: rows with FakturaStatus = 'Ny'.
+    `active` holds all matching active tilsyn and is left out when paging on
+    with `before` (opaque cursor from `next`, history only). `since` (a
+    created_at value) restricts both parts to tilsyn created after it.
     """
-    engine = get_connection()
+    keep = _tilsyn_filter(args)
+    matching = [i for i in items if keep(i)]
+    active = [i for i in matching if tilsyn_status(i) == 'aktiv']
+    matching = [i for i in matching if tilsyn_status(i) != 'aktiv']
+    total = len(matching)
+
+    since = (args.get('since') or '').strip()
+    if since:
+        active = [i for i in active if (i.get('created_at') or '') > since]
+        matching = [i for i in matching if (i.get('created_at') or '') > since]
+    before = (args.get('before') or '').strip()
+    if before:
+        before_key = _decode_tilsyn_cursor(before)
+        matching = [i for i in matching if _tilsyn_key(i) < before_key]
 
-    # Pagination
-    try:
-        limit = int(request.args.get('limit', 10))
-    except Exception:
-        limit = 10
     try:
-        offset = int(request.args.get('offset', 0))
-    except Exception:
-        offset = 0
-
-    # Search & sorting
-    search = (request.args.get('search') or '').strip()
-    sort_ui = (request.args.get('sort') or 'Ansøger').strip()
-    order = (request.args.get('order') or 'asc').upper()
-    order = 'DESC' if order.lower() == 'desc' else 'ASC'
-    sort_col = SORTABLE_COLUMNS.get(sort_ui, 'Ansøger')
-
-    base_where = "FakturaStatus = 'Ny'"
+        limit = int(args.get('limit') or TILSYN_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("Ugyldig limit")
+    limit = max(1, min(limit, TILSYN_MAX_PAGE_SIZE))
+    page = matching[:limit]
+    result = {
+        'items': page,
+        'total': total,
+        'next': _encode_tilsyn_cursor(page[-1]) if len(matching) > limit else None,
+    }
+    if not before:
+        result['active'] = active
+    return result
 
-    params = {}
-    search_clause = ''
-    if search:
-        search_clause = """
-            AND (
-                Ansøger LIKE :q OR
-                FørsteSted LIKE :q OR
-                Tilladelsesnr LIKE :q OR
-                CONVERT(varchar(20), CvrNr) LIKE :q OR
-                TilladelsesType LIKE :q
-            )
-        """
-        params['q'] = f"%{search}%"
+@app.route('/tilsyn/data')
+@login_required
+def tilsyn_data():
+    """Proxy: fetch all tilsyn tasks + history from PyOrchestratorAPI and
+    return the combined list filtered to type=indmeldt.
 
-    count_sql = text(f"""
-        SELECT COUNT(*) AS cnt
-        FROM [dbo].[VejmanFakturering]
-        WHERE {base_where} {search_clause}
-    """)
+    Without `limit` the whole list is returned as an array. With `limit`
+    the response holds all active tilsyn plus one page of history
+    ({active, items, total, next}; see tilsyn_page_payload) and accepts the
+    filters status, street, created_by, search, created_from, created_to
+    plus the `before` / `since` cursors.
+    """
+    if not orchestrator.api_key:
+        return jsonify({"error": "API-nøgle mangler"}), 500
 
-    data_sql = text(f"""
-        SELECT
-            ID,
-            VejmanID,
-            Ansøger,
-            FørsteSted,
-            Tilladelsesnr,
-            CvrNr,
-            TilladelsesType,
-            Enhedspris,
-            Meter,
-            Startdato,
-            Slutdato,
-            AntalDage,
-            TotalPris,
-            FakturaStatus,
-            PEZUUID
-        FROM [dbo].[VejmanFakturering]
-        WHERE {base_where} {search_clause}
-        ORDER BY {sort_col} {order}
-        OFFSET :offset ROWS
-        FETCH NEXT :limit ROWS ONLY
-    """)
+    try:
+        items, etag = fetch_tilsyn_items()
+    except requests.exceptions.RequestException as e:
+        return jsonify({"error": f"Netværksfejl: {str(e)}"}), 500
 
-    with engine.begin() as conn:
-        total = conn.execute(count_sql, params).scalar()
-        rows = conn.execute(data_sql, {**params, 'offset': offset, 'limit': limit}).mappings().all()
+    if 'limit' in request.args:
+        try:
+            resp = jsonify(tilsyn_page_payload(items, request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        etag = hashlib.sha1(f"{etag}?{request.query_string.decode('latin-1')}".encode('utf-8')).hexdigest()
+    else:
+        resp = jsonify(items)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp.make_conditional(request)
 
-    out = []
-    for r in rows:
-        out.append({
-            'ID': r['ID'],
-            'VejmanID': r['VejmanID'],
-            'Ansøger': r['Ansøger'] or '',
-            'Adresse': r['FørsteSted'] or '',
-            'Tilladelsesnr': r['Tilladelsesnr'] or '',
-            'CvrNr': r['CvrNr'] or '',
-            'TilladelsesType': r['TilladelsesType'] or '',
-            'Enhedspris': fmt_num(r['Enhedspris']),
-            'Meter': fmt_num(r['Meter']),
-            'Startdato': fmt_date(r['Startdato']),
-            'Slutdato': fmt_date(r['Slutdato']),
-            'AntalDage': r['AntalDage'] if r['AntalDage'] is not None else 0,
-            'TotalPris': fmt_num(r['TotalPris']),
-            'FakturaStatus': r['FakturaStatus'] or '',
-            'PEZUUID': str(r.get('PEZUUID') or ''),
-        })
+# ------------------------- API: Lists -------------------------
 
-    return jsonify({'total': total, 'rows': out})
+@app.route('/api/ikkefaktureret')
+def ikkefaktureret_data():
+    """Server-side endpoint for the 'Ikke faktureret' view.
+    New logic: rows with FakturaStatus = 'Ny'.
+    """
+    return jsonify(run_list_view('ikkefaktureret', request.args))
 
 @app.route('/api/tilfakturering')
 def tilfakturering_data():
     """Server-side for 'Til fakturering' (FakturaStatus='Afsendt')."""
-    engine = get_connection()
-
-    try:
-        limit = int(request.args.get('limit', 10))
-    except Exception:
-        limit = 10
-    try:
-        offset = int(request.args.get('offset', 0))
-    except Exception:
-        offset = 0
+    return jsonify(run_list_view('tilfakturering', request.args))
 
-    search = (request.args.get('search') or '').strip()
-    sort_ui = (request.args.get('sort') or 'Ansøger').strip()
-    order = (request.args.get('order') or 'asc').upper()
-    order = 'DESC' if order.lower() == 'desc' else 'ASC'
-    sort_col = SORTABLE_COLUMNS.get(sort_ui, 'Ansøger')
+@app.route('/api/faktureret')
+def faktureret_data():
+    """Server-side for 'Faktureret' (FakturaStatus='Faktureret')."""
+    return jsonify(run_list_view('faktureret', request.args))
 
-    base_where = "FakturaStatus = 'Afsendt'"
+# ------------------------- Row: Read & Update -------------------------
 
-    params = {}
-    search_clause = ''
-    if search:
-        search_clause = """
-            AND (
-                Ansøger LIKE :q OR
-                FørsteSted LIKE :q OR
-                Tilladelsesnr LIKE :q OR
-                CONVERT(varchar(20), CvrNr) LIKE :q OR
-                TilladelsesType LIKE :q
-            )
-        """
-        params['q'] = f"%{search}%"
+# Version of a row's editable fields. Returned by get_row and required by
+# /update, so an edit made on stale data (another caseworker or a sync changed
+# the row meanwhile) is rejected with 409 instead of silently overwriting.
+# Meter is hashed as decimal(38, 10): the default varchar conversion keeps only
+# 6 significant digits of a float, so some edits would not change the version.
+ROW_VERSION_SQL = """CONVERT(varchar(64), HASHBYTES('SHA2_256', CONCAT(
+    CONVERT(varchar(48), CAST(Meter AS decimal(38, 10))), '|',
+    CONVERT(varchar(10), Startdato, 23), '|',
+    CONVERT(varchar(10), Slutdato, 23), '|',
+    FakturaStatus)), 2)"""
+
+ROW_DETAIL_SELECT = f"""
+    ID,
+    VejmanID,
+    FørsteSted,
+    Tilladelsesnr,
+    Ansøger,
+    CvrNr,
+    TilladelsesType,
+    Enhedspris,
+    Meter,
+    Startdato,
+    Slutdato,
+    AntalDage,
+    TotalPris,
+    FakturaStatus,
+    FakturaNr,
+    VejmanFakturaID,
+    ATT,
+    FakturaDato,
+    Ordrenummer,
+    {ROW_VERSION_SQL} AS RowVersion
+"""
+
+def row_detail(row):
+    """JSON shape of one fakturalinje for the edit modal."""
+    return {
+        'ID': row['ID'],
+        'VejmanID': row['VejmanID'],
+        'Adresse': row['FørsteSted'] or '',
+        'Tilladelsesnr': row['Tilladelsesnr'] or '',
+        'Ansøger': row['Ansøger'] or '',
+        'CvrNr': str(row['CvrNr'] or ''),
+        'TilladelsesType': row['TilladelsesType'] or '',
+        'Enhedspris': fmt_num(row['Enhedspris']),
+        'Meter': fmt_num(row['Meter']),
+        'Startdato': fmt_date_iso(row['Startdato']),
+        'Slutdato': fmt_date_iso(row['Slutdato']),
+        'AntalDage': row['AntalDage'],
+        'TotalPris': fmt_num(row['TotalPris']),
+        'FakturaStatus': (row['FakturaStatus'] or '').strip(),
+        'FakturaNr': row['FakturaNr'] or '',
+        'VejmanFakturaID': row['VejmanFakturaID'],
+        'ATT': row['ATT'] or '',
+        'FakturaDato': fmt_date_iso(row['FakturaDato']),
+        'Ordrenummer': row['Ordrenummer'] or '',
+        'Version': row['RowVersion'],
+    }
 
-    count_sql = text(f"""
-        SELECT COUNT(*) AS cnt
-        FROM [dbo].[VejmanFakturering]
-        WHERE {base_where} {search_clause}
-    """)
+ROW_BATCH_MAX = 200
 
-    data_sql = text(f"""
-        SELECT
-            ID,
-            VejmanID,
-            Ansøger,
-            FørsteSted,
-            Tilladelsesnr,
-            CvrNr,
-            TilladelsesType,
-            Enhedspris,
-            Meter,
-            Startdato,
-            Slutdato,
-            AntalDage,
-            TotalPris,
-            FakturaStatus,
-            PEZUUID
+def fetch_row_details(conn, ids):
+    """{ID: row_detail(...)} for the given IDs in one query; unknown IDs are absent."""
+    if not ids:
+        return {}
+    sql = text(f"""
+        SELECT {ROW_DETAIL_SELECT}
         FROM [dbo].[VejmanFakturering]
-        WHERE {base_where} {search_clause}
-        ORDER BY {sort_col} {order}
-        OFFSET :offset ROWS
-        FETCH NEXT :limit ROWS ONLY
-    """)
+        WHERE ID IN :ids
+    """).bindparams(bindparam('ids', expanding=True))
+    return {r['ID']: row_detail(r) for r in conn.execute(sql, {'ids': list(ids)}).mappings()}
+
+# ---- Row cache ----
+#
+# row_detail() payloads by ID for the batch prefetch of the visible page.
+# Entries are dropped by this process's write endpoints
+# (invalidate_row_caches), belong to one sync (a new SyncedAt starts over) and
+# otherwise expire after ROW_CACHE_TTL, so writes made by another worker
+# process can be missed for that long. The single-row endpoint the edit modal
+# relies on therefore always reads the database.
+
+ROW_CACHE_TTL = 60
+ROW_CACHE_SIZE = 2000
+
+class RowCache:
+    def __init__(self):
+        self._rows = TTLCache(ttl=ROW_CACHE_TTL, maxsize=ROW_CACHE_SIZE)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, ids):
+        """{ID: row_detail} for `ids`, reading only the uncached IDs from the database."""
+        synced_at = _latest_sync_at()
+        found = {}
+        for i in ids:
+            d = self._rows.get((synced_at, i))
+            if d is not None:
+                found[i] = d
+        todo = [i for i in ids if i not in found]
+        if todo:
+            with self._lock:
+                generation = self._generation
+            engine = get_connection()
+            with engine.begin() as conn:
+                fetched = fetch_row_details(conn, todo)
+            with self._lock:
+                # skip storing if a write invalidated rows while we were reading
+                if generation == self._generation:
+                    for i, d in fetched.items():
+                        self._rows.set((synced_at, i), d)
+            found.update(fetched)
+        return found
+
+    def invalidate(self, ids=None):
+        """Drop `ids` (or everything) after a write."""
+        with self._lock:
+            self._generation += 1
+            if ids is None:
+                self._rows.clear()
+                return
+            synced_at = _latest_sync_at()
+            for i in ids:
+                self._rows.pop((synced_at, i))
+
+row_cache = RowCache()
 
+@app.route('/api/fakturering/<int:row_id>')
+@login_required
+def get_row(row_id):
+    engine = get_connection()
     with engine.begin() as conn:
-        total = conn.execute(count_sql, params).scalar()
-        rows = conn.execute(data_sql, {**params, 'offset': offset, 'limit': limit}).mappings().all()
-
-    out = []
-    for r in rows:
-        out.append({
-            'ID': r['ID'],
-            'VejmanID': r['VejmanID'],
-            'Ansøger': r['Ansøger'] or '',
-            'Adresse': r['FørsteSted'] or '',
-            'Tilladelsesnr': r['Tilladelsesnr'] or '',
-            'CvrNr': r['CvrNr'] or '',
-            'TilladelsesType': r['TilladelsesType'] or '',
-            'Enhedspris': fmt_num(r['Enhedspris']),
-            'Meter': fmt_num(r['Meter']),
-            'Startdato': fmt_date(r['Startdato']),
-            'Slutdato': fmt_date(r['Slutdato']),
-            'AntalDage': r['AntalDage'] if r['AntalDage'] is not None else 0,
-            'TotalPris': fmt_num(r['TotalPris']),
-            'FakturaStatus': r['FakturaStatus'] or '',
-            'PEZUUID': str(r.get('PEZUUID') or ''),
-        })
+        row = fetch_row_details(conn, [row_id]).get(row_id)
+    if not row:
+        return jsonify(success=False, error='Række ikke fundet'), 404
 
-    return jsonify({'total': total, 'rows': out})
+    return jsonify(success=True, data=row)
 
-@app.route('/api/faktureret')
-def faktureret_data():
-    """Server-side for 'Faktureret' (FakturaStatus='Faktureret')."""
-    engine = get_connection()
+def _parse_ids(raw):
+    """'1,2,3' -> [1, 2, 3] (deduplicated, order kept); ValueError on junk."""
+    return list(dict.fromkeys(int(v) for v in (raw or '').split(',') if v.strip()))
 
+@app.route('/api/fakturering/batch')
+@login_required
+def get_rows():
+    """Many fakturalinjer in one call: ?ids=1,2,3 (at most ROW_BATCH_MAX)."""
     try:
-        limit = int(request.args.get('limit', 10))
-    except Exception:
-        limit = 10
-    try:
-        offset = int(request.args.get('offset', 0))
-    except Exception:
-        offset = 0
-
-    search = (request.args.get('search') or '').strip()
-    sort_ui = (request.args.get('sort') or 'Ansøger').strip()
-    order = (request.args.get('order') or 'asc').upper()
-    order = 'DESC' if order.lower() == 'desc' else 'ASC'
-    sort_col = SORTABLE_COLUMNS.get(sort_ui, 'Ansøger')
-
-    base_where = "FakturaStatus = 'Faktureret'"
+        ids = _parse_ids(request.args.get('ids'))
+    except ValueError:
+        return jsonify(success=False, error='Ugyldige ID\'er'), 400
+    if not ids:
+        return jsonify(success=False, error='ids mangler'), 400
+    if len(ids) > ROW_BATCH_MAX:
+        return jsonify(success=False, error=f'Højst {ROW_BATCH_MAX} linjer ad gangen'), 400
+
+    rows = row_cache.get_many(ids)
+    return jsonify(success=True,
+                   data=[rows[i] for i in ids if i in rows],
+                   missing=[i for i in ids if i not in rows])
+
+def applied_or_current_sql(applied_select):
+    """`returning` for audited_update_sql on a single row (:ID): `applied_select`
+    if the UPDATE changed it, else the current row for a 409. Both start with
+    an Applied bit column; no row at all means the ID doesn't exist."""
+    return f"""
+        IF EXISTS (SELECT 1 FROM #changed)
+            {applied_select}
+        ELSE
+            SELECT CAST(0 AS bit) AS Applied, {ROW_DETAIL_SELECT}
+            FROM [dbo].[VejmanFakturering]
+            WHERE ID = :ID
+    """
 
-    params = {}
-    search_clause = ''
-    if search:
-        search_clause = """
-            AND (
-                Ansøger LIKE :q OR
-                FørsteSted LIKE :q OR
-                Tilladelsesnr LIKE :q OR
-                CONVERT(varchar(20), CvrNr) LIKE :q OR
-                TilladelsesType LIKE :q
-                OR CONVERT(varchar(20), Ordrenummer) LIKE :q
-            )
-        """
-        params['q'] = f"%{search}%"
+CONFLICT_MESSAGE = ("Linjen er blevet ændret af en anden bruger eller en synkronisering, "
+                    "siden du åbnede den. Kontrollér de nuværende værdier og prøv igen.")
 
-    count_sql = text(f"""
-        SELECT COUNT(*) AS cnt
-        FROM [dbo].[VejmanFakturering]
-        WHERE {base_where} {search_clause}
-    """)
-
-    data_sql = text(f"""
-        SELECT
-            ID,
-            VejmanID,
-            Ansøger,
-            FørsteSted,
-            Tilladelsesnr,
-            CvrNr,
-            TilladelsesType,
-            Startdato,
-            Slutdato,
-            TotalPris,
-            FakturaDato,
-            Ordrenummer,
-            PEZUUID
-        FROM [dbo].[VejmanFakturering]
-        WHERE {base_where} {search_clause}
-        ORDER BY {sort_col} {order}
-        OFFSET :offset ROWS
-        FETCH NEXT :limit ROWS ONLY
-    """)
-
-    with engine.begin() as conn:
-        total = conn.execute(count_sql, params).scalar()
-        rows = conn.execute(data_sql, {**params, 'offset': offset, 'limit': limit}).mappings().all()
-
-    out = []
-    for r in rows:
-        out.append({
-            'ID': r['ID'],
-            'VejmanID': r['VejmanID'],
-            'Ansøger': r['Ansøger'] or '',
-            'Adresse': r['FørsteSted'] or '',
-            'Tilladelsesnr': r['Tilladelsesnr'] or '',
-            'CvrNr': r['CvrNr'] or '',
-            'TilladelsesType': r['TilladelsesType'] or '',
-            'Startdato': fmt_date(r['Startdato']),
-            'Slutdato': fmt_date(r['Slutdato']),
-            'TotalPris': fmt_num(r['TotalPris']),
-            'FakturaDato': fmt_date(r['FakturaDato']),
-            'Ordrenummer': r['Ordrenummer'],
-            'PEZUUID': str(r.get('PEZUUID') or ''),
-        })
-
-    return jsonify({'total': total, 'rows': out})
-
-# ------------------------- Row: Read & Update -------------------------
-
-@app.route('/api/fakturering/<int:row_id>')
-def get_row(row_id):
-    engine = get_connection()
-    sql = text("""
-        SELECT TOP 1
-            ID,
-            VejmanID,
-            FørsteSted,
-            Tilladelsesnr,
-            Ansøger,
-            CvrNr,
-            TilladelsesType,
-            Enhedspris,
-            Meter,
-            Startdato,
-            Slutdato,
-            AntalDage,
-            TotalPris,
-            FakturaStatus,
-            FakturaNr,
-            VejmanFakturaID,
-            ATT,
-            FakturaDato,
-            Ordrenummer
-        FROM [dbo].[VejmanFakturering]
-        WHERE ID = :id
-    """)
-    with engine.begin() as conn:
-        row = conn.execute(sql, {'id': row_id}).mappings().first()
-
-    if not row:
-        return jsonify(success=False, error='Række ikke fundet'), 404
-
-    status = (row['FakturaStatus'] or '').strip()
-
-    return jsonify(success=True, data={
-        'ID': row['ID'],
-        'VejmanID': row['VejmanID'],
-        'Adresse': row['FørsteSted'] or '',
-        'Tilladelsesnr': row['Tilladelsesnr'] or '',
-        'Ansøger': row['Ansøger'] or '',
-        'CvrNr': str(row['CvrNr'] or ''),
-        'TilladelsesType': row['TilladelsesType'] or '',
-        'Enhedspris': fmt_num(row['Enhedspris']),
-        'Meter': fmt_num(row['Meter']),
-        'Startdato': fmt_date_iso(row['Startdato']),
-        'Slutdato': fmt_date_iso(row['Slutdato']),
-        'AntalDage': row['AntalDage'],
-        'TotalPris': fmt_num(row['TotalPris']),
-        'FakturaStatus': status,
-        'FakturaNr': row['FakturaNr'] or '',
-        'VejmanFakturaID': row['VejmanFakturaID'],
-        'ATT': row['ATT'] or '',
-        'FakturaDato': fmt_date_iso(row['FakturaDato']),
-        'Ordrenummer': row['Ordrenummer'] or ''
-    })
+_UPDATED_ROW_SQL = applied_or_current_sql("""
+    SELECT
+        CAST(1 AS bit) AS Applied,
+        v.ID, v.VejmanID, v.Ansøger, v.FørsteSted, v.Tilladelsesnr, v.CvrNr, v.TilladelsesType,
+        v.Enhedspris, v.Meter, v.Startdato, v.Slutdato, v.AntalDage, v.TotalPris, v.FakturaStatus,
+        c.OldMeter, c.NewMeter, c.OldStartdato, c.NewStartdato,
+        c.OldSlutdato, c.NewSlutdato, c.OldStatus, c.NewStatus
+    FROM #changed c
+    JOIN [dbo].[VejmanFakturering] v ON v.ID = c.ID
+""")
 
 @csrf.exempt
 @app.route('/update', methods=['POST'])
@@ -666,11 +1359,14 @@ def update_row():
     """
     Only allow editing of Meter, Startdato, Slutdato. Status is updated only if the
     payload explicitly asks to send for billing or mark as do-not-invoice.
+    The payload must carry the Version from /api/fakturering/<id>; 409 with the
+    current row if the row has changed since.
     """
     data = request.get_json(force=True) or {}
     errors = []
 
     row_id = data.get('ID')
+    version = (data.get('Version') or '').strip()
     meter_raw = data.get('Meter', '')
     start_raw = data.get('Startdato', '')
     slut_raw = data.get('Slutdato', '')
@@ -680,6 +1376,8 @@ def update_row():
     # Validate id
     if not row_id:
         errors.append("ID mangler.")
+    if not version:
+        errors.append("Version mangler. Genindlæs siden og prøv igen.")
 
     # Parse number (comma or dot)
     meter = None
@@ -724,59 +1422,37 @@ def update_row():
         'Meter': meter,
         'Startdato': startdato,
         'Slutdato': slutdato,
-        'ID': row_id
+        'ID': row_id,
+        'version': version,
     }
     if set_status_to:
         set_parts.append("FakturaStatus = :FakturaStatus")
         params['FakturaStatus'] = set_status_to
 
-    sql_update = text(f"""
-        UPDATE [dbo].[VejmanFakturering]
-        SET {', '.join(set_parts)}
-        WHERE ID = :ID
-    """)
+    action = "edit"
+    if set_status_to == "Afsendt":
+        action = "send_for_billing"
+    elif set_status_to == "FakturerIkke":
+        action = "mark_do_not_invoice"
+    params['action'] = action
+    params['user'] = session["user"]["email"]
 
-    sql_select = text("""
-        SELECT
-            ID, VejmanID, Ansøger, FørsteSted, Tilladelsesnr, CvrNr, TilladelsesType,
-            Enhedspris, Meter, Startdato, Slutdato, AntalDage, TotalPris, FakturaStatus
-        FROM [dbo].[VejmanFakturering]
-        WHERE ID = :ID
-    """)
+    # Update, audit and read back the row in one round-trip
+    sql = audited_update_sql(', '.join(set_parts), f"ID = :ID AND {ROW_VERSION_SQL} = :version",
+                             returning=_UPDATED_ROW_SQL)
 
     engine = get_connection()
-
-    sql_before = text("""
-        SELECT Meter, Startdato, Slutdato, FakturaStatus
-        FROM [dbo].[VejmanFakturering]
-        WHERE ID = :ID
-    """)
-
     with engine.begin() as conn:
-        old_row = conn.execute(sql_before, {"ID": row_id}).mappings().first()
-        res = conn.execute(sql_update, params)
-        if res.rowcount == 0:
-            return jsonify(success=False, errors=['Fakturalinjen blev ikke fundet.']), 404
-
-        # Fetch the row again
-        r = conn.execute(sql_select, {'ID': row_id}).mappings().first()
-        new_row = conn.execute(sql_select, {"ID": row_id}).mappings().first()
-
-        action = "edit"
-        if set_status_to == "Afsendt":
-            action = "send_for_billing"
-        elif set_status_to == "FakturerIkke":
-            action = "mark_do_not_invoice"
-
-        log_action(
-            conn,
-            row_id=row_id,
-            action_type=action,
-            old=old_row,
-            new=new_row,
-            user_email=session["user"]["email"]
-        )
+        r = conn.execute(sql, params).mappings().first()
+    if r is None:
+        return jsonify(success=False, errors=['Fakturalinjen blev ikke fundet.']), 404
+    if not r['Applied']:
+        row_cache.invalidate([r['ID']])   # changed elsewhere; don't serve the old copy
+        return jsonify(success=False, conflict=True, errors=[CONFLICT_MESSAGE], current=row_detail(r)), 409
 
+    audit_queue.record(action, params['user'], [r])
+    invalidate_row_caches([r['ID']])
+    adjust_nav_counts([r])
 
     updated_row = {
         'ID': r['ID'],
@@ -797,41 +1473,40 @@ def update_row():
 
     return jsonify(success=True, data=updated_row)
 
+def _fortryd(row_id, action):
+    """Apply the BULK_ACTIONS transition `action` to one row. The row must still
+    be in the source status (and match the optional body Version); otherwise 409."""
+    from_status, to_status = BULK_ACTIONS[action]
+    data = request.get_json(silent=True) or {}
+    where = "ID = :ID AND FakturaStatus = :from_status"
+    params = {'ID': row_id, 'from_status': from_status, 'to_status': to_status,
+              'action': action, 'user': session["user"]["email"]}
+    if data.get('Version'):
+        where += f" AND {ROW_VERSION_SQL} = :version"
+        params['version'] = data['Version']
+
+    sql = audited_update_sql("FakturaStatus = :to_status", where,
+                             returning=applied_or_current_sql("SELECT CAST(1 AS bit) AS Applied, c.* FROM #changed c"))
+    engine = get_connection()
+    with engine.begin() as conn:
+        r = conn.execute(sql, params).mappings().first()
+    if r is None:
+        return jsonify(success=False, error='Række ikke fundet'), 404
+    if not r['Applied']:
+        row_cache.invalidate([row_id])
+        return jsonify(success=False, conflict=True, error=CONFLICT_MESSAGE, current=row_detail(r)), 409
+    audit_queue.record(action, params['user'], [r])
+    invalidate_row_caches([row_id])
+    adjust_nav_counts([r])
+    return jsonify(success=True, data={'ID': row_id})
+
 # Fortryd from 'Til fakturering' list -> set back to 'Ny'
 @csrf.exempt
 @app.route('/api/tilfakturering/fortryd/<int:row_id>', methods=['POST'])
 @login_required
 @role_required("Vejmankassen-Admin", "Vejmankassen-Sagsbehandler")
 def fortryd_fakturering(row_id):
-    engine = get_connection()
-    sql = text("""
-        UPDATE [dbo].[VejmanFakturering]
-        SET FakturaStatus = 'Ny'
-        WHERE ID = :id
-    """)
-    with engine.begin() as conn:
-        old = conn.execute(text("""
-            SELECT Meter, Startdato, Slutdato, FakturaStatus
-            FROM VejmanFakturering
-            WHERE ID = :id
-        """), {"id": row_id}).mappings().first()
-
-        res = conn.execute(sql, {'id': row_id})
-
-
-        new = { **old, "FakturaStatus": "Ny" }
-
-        log_action(conn,
-            row_id=row_id,
-            action_type="undo_send",
-            old=old,
-            new=new,
-            user_email=session["user"]["email"]
-        )
-
-        if res.rowcount == 0:
-            return jsonify(success=False, error='Række ikke fundet'), 404
-    return jsonify(success=True, data={'ID': row_id})
+    return _fortryd(row_id, 'undo_send')
 
 # 'Faktureret' -> reinvoice button: move to 'FakturerIkke'
 @csrf.exempt
@@ -839,201 +1514,811 @@ def fortryd_fakturering(row_id):
 @login_required
 @role_required("Vejmankassen-Admin", "Vejmankassen-Sagsbehandler")
 def faktureret_fortryd(row_id):
+    return _fortryd(row_id, 'undo_faktureret')
+
+# ---- Bulk status transitions ----
+#
+# One transaction per request: a set-based UPDATE guarded on the expected
+# current status, audited in the same batch (see audited_update_sql).
+
+BULK_ACTIONS = {
+    # action (also the log ActionType): (required current status, new status)
+    'send_for_billing':    ('Ny', 'Afsendt'),
+    'mark_do_not_invoice': ('Ny', 'FakturerIkke'),
+    'undo_send':           ('Afsendt', 'Ny'),
+    'undo_faktureret':     ('Faktureret', 'FakturerIkke'),
+}
+BULK_MAX_IDS = 2000     # SQL Server allows ~2100 parameters per statement
+
+class BulkLimitExceeded(Exception):
+    """A search-mode bulk change matched more rows than allowed or expected;
+    raised inside the transaction so the UPDATE is rolled back."""
+
+    def __init__(self, matched):
+        super().__init__(matched)
+        self.matched = matched
+
+def _bulk_search_target(search):
+    """(clause, params) for rows matching a non-empty `search`, or None if nothing matches."""
+    search = (search or '').strip()
+    if not search:
+        raise ValueError('Angiv en søgning eller vælg linjer')
+    mode, target, search_params = search_filter(search, SEARCH_COLUMNS)
+    if mode == 'none':
+        return None
+    return target, search_params
+
+def bulk_search_count(conn, action, search):
+    """Rows in the action's source status matching `search` (for the confirm dialog)."""
+    found = _bulk_search_target(search)
+    if found is None:
+        return 0
+    target, params = found
+    stmt = with_ids(text(f"""
+        SELECT COUNT(*) FROM [dbo].[VejmanFakturering]
+        WHERE FakturaStatus = :from_status AND {target}
+    """), params)
+    return conn.execute(stmt, {**params, 'from_status': BULK_ACTIONS[action][0]}).scalar() or 0
+
+def bulk_transition(conn, action, *, user_email, ids=None, search=None, expected=None):
+    """Apply BULK_ACTIONS[action] to `ids`, or to every row in the source status
+    matching `search` (non-empty; at most BULK_MAX_IDS rows, and exactly
+    `expected` when given, else BulkLimitExceeded). Returns the #changed rows
+    (ID plus old/new values)."""
+    from_status, to_status = BULK_ACTIONS[action]
+    params = {'from_status': from_status, 'to_status': to_status,
+              'action': action, 'user': user_email}
+    if ids is not None:
+        target, params['ids'] = "ID IN :ids", list(ids)
+    else:
+        found = _bulk_search_target(search)
+        if found is None:
+            return []
+        target, search_params = found
+        params.update(search_params)
+    stmt = with_ids(audited_update_sql("FakturaStatus = :to_status",
+                                       f"FakturaStatus = :from_status AND {target}"), params)
+    rows = conn.execute(stmt, params).mappings().all()
+    if ids is None and (len(rows) > BULK_MAX_IDS or (expected is not None and len(rows) != expected)):
+        raise BulkLimitExceeded(len(rows))
+    return rows
+
+@csrf.exempt
+@app.route('/api/fakturering/bulk', methods=['POST'])
+@login_required
+@role_required("Vejmankassen-Admin", "Vejmankassen-Sagsbehandler")
+def bulk_status():
+    """
+    Body: {"action": <BULK_ACTIONS key>, "ids": [..]} or
+          {"action": .., "search": "..", "expected": n}
+    (all rows in the action's source status matching the non-empty search;
+    at most BULK_MAX_IDS, and exactly `expected` if given, else nothing changes).
+    With "preview": true in search mode only the matching count is returned.
+    Returns per-ID outcomes.
+    """
+    data = request.get_json(force=True) or {}
+    action = data.get('action')
+    if action not in BULK_ACTIONS:
+        return jsonify(success=False, error='Ukendt handling'), 400
+
+    ids = data.get('ids')
+    if ids is not None:
+        try:
+            ids = list(dict.fromkeys(int(i) for i in ids))
+        except (TypeError, ValueError):
+            return jsonify(success=False, error='Ugyldige ID\'er'), 400
+        if not ids:
+            return jsonify(success=False, error='Ingen linjer valgt'), 400
+        if len(ids) > BULK_MAX_IDS:
+            return jsonify(success=False, error=f'Højst {BULK_MAX_IDS} linjer ad gangen'), 400
+    elif 'search' not in data:
+        return jsonify(success=False, error='ids eller search mangler'), 400
+    elif not str(data.get('search') or '').strip():
+        return jsonify(success=False, error='Angiv en søgning eller vælg linjer'), 400
+
+    expected = data.get('expected')
+    if expected is not None:
+        try:
+            expected = int(expected)
+        except (TypeError, ValueError):
+            return jsonify(success=False, error='Ugyldigt antal'), 400
+
+    from_status, _ = BULK_ACTIONS[action]
+    user_email = session["user"]["email"]
     engine = get_connection()
-    sql = text("""
-        UPDATE [dbo].[VejmanFakturering]
-        SET FakturaStatus = 'FakturerIkke'
-        WHERE ID = :id
+
+    if ids is None and data.get('preview'):
+        with engine.begin() as conn:
+            matching = bulk_search_count(conn, action, data['search'])
+        return jsonify(success=True, matching=matching, status=from_status, max=BULK_MAX_IDS)
+
+    try:
+        with engine.begin() as conn:
+            changed_rows = bulk_transition(conn, action, user_email=user_email, ids=ids,
+                                           search=data.get('search'), expected=expected)
+            changed = [r['ID'] for r in changed_rows]
+
+            # Explain the IDs that were not changed
+            current = {}
+            changed_set = set(changed)
+            missing = [i for i in ids or () if i not in changed_set]
+            if missing:
+                stmt = text("""
+                    SELECT ID, FakturaStatus FROM [dbo].[VejmanFakturering] WHERE ID IN :ids
+                """).bindparams(bindparam('ids', expanding=True))
+                current = {r[0]: (r[1] or '').strip() for r in conn.execute(stmt, {'ids': missing})}
+    except BulkLimitExceeded as e:
+        if e.matched > BULK_MAX_IDS:
+            return jsonify(success=False, matching=e.matched,
+                           error=f'Søgningen matcher {e.matched} linjer; højst {BULK_MAX_IDS} ad gangen'), 400
+        return jsonify(success=False, matching=e.matched,
+                       error='Antallet af matchende linjer har ændret sig. Prøv igen.'), 409
+
+    if changed:
+        audit_queue.record(action, user_email, changed_rows)
+        invalidate_row_caches(changed)
+        adjust_nav_counts(changed_rows)
+
+    results = [{'ID': i, 'success': True} for i in changed]
+    for i in missing:
+        if i in current:
+            error = f'Linjen har status {current[i]}, forventet {from_status}'
+        else:
+            error = 'Række ikke fundet'
+        results.append({'ID': i, 'success': False, 'error': error})
+
+    return jsonify(success=True, changed=len(changed), failed=len(missing), results=results)
+
+# ------------------------- Audit log -------------------------
+#
+# Reads VejmanFaktureringLog newest first. Pages are keyset-paged on the
+# identity column LogID (insertion order): `before` is the last LogID of the
+# previous page, so deep pages cost the same as the first one. See the readme
+# for the indexes that back the RowID / user / action filters.
+
+AUDIT_PAGE_SIZE = 50
+AUDIT_MAX_PAGE_SIZE = 200
+AUDIT_ACTIONS = {
+    'edit': 'Redigeret',
+    'send_for_billing': 'Sendt til fakturering',
+    'mark_do_not_invoice': 'Fakturer ikke',
+    'undo_send': 'Fortrudt afsendelse',
+    'undo_faktureret': 'Fjernet fra faktureret',
+}
+
+def _audit_entry(r):
+    return {
+        'LogID': r['LogID'],
+        'RowID': r['RowID'],
+        'ActionType': r['ActionType'] or '',
+        'OldMeter': fmt_num(r['OldMeter']) if r['OldMeter'] is not None else '',
+        'NewMeter': fmt_num(r['NewMeter']) if r['NewMeter'] is not None else '',
+        'OldStartdato': fmt_date(r['OldStartdato']) if r['OldStartdato'] else '',
+        'NewStartdato': fmt_date(r['NewStartdato']) if r['NewStartdato'] else '',
+        'OldSlutdato': fmt_date(r['OldSlutdato']) if r['OldSlutdato'] else '',
+        'NewSlutdato': fmt_date(r['NewSlutdato']) if r['NewSlutdato'] else '',
+        'OldStatus': (r['OldStatus'] or '').strip(),
+        'NewStatus': (r['NewStatus'] or '').strip(),
+        'PerformedBy': r['PerformedBy'] or '',
+        'PerformedAt': r['PerformedAt'].strftime('%d-%m-%Y %H:%M:%S') if r['PerformedAt'] else '',
+    }
+
+def audit_page(where, params, args):
+    """One page of log entries matching `where`, newest first: {rows, next}."""
+    try:
+        limit = max(1, min(int(args.get('limit') or AUDIT_PAGE_SIZE), AUDIT_MAX_PAGE_SIZE))
+        before = int(args['before']) if args.get('before') else None
+    except ValueError:
+        raise ValueError('Ugyldig limit eller cursor')
+
+    where, params = list(where), dict(params)
+    if before is not None:
+        where.append("LogID < :before")
+        params['before'] = before
+    params['limit'] = limit + 1
+
+    sql = text(f"""
+        SELECT TOP (:limit)
+            LogID, RowID, ActionType,
+            OldMeter, NewMeter,
+            OldStartdato, NewStartdato,
+            OldSlutdato, NewSlutdato,
+            OldStatus, NewStatus,
+            PerformedBy, PerformedAt
+        FROM VejmanFaktureringLog
+        WHERE {' AND '.join(where) or '1 = 1'}
+        ORDER BY LogID DESC
     """)
+    engine = get_connection()
     with engine.begin() as conn:
-        old = conn.execute(text("""
-            SELECT Meter, Startdato, Slutdato, FakturaStatus
-            FROM VejmanFakturering
-            WHERE ID = :id
-        """), {"id": row_id}).mappings().first()
-
-        res = conn.execute(sql, {'id': row_id})
-        new = { **old, "FakturaStatus": "FakturerIkke" }
-
-        log_action(conn,
-            row_id=row_id,
-            action_type="undo_faktureret",
-            old=old,
-            new=new,
-            user_email=session["user"]["email"]
-        )
-        if res.rowcount == 0:
-            return jsonify(success=False, error='Række ikke fundet'), 404
-    return jsonify(success=True, data={'ID': row_id})
+        rows = conn.execute(sql, params).mappings().all()
 
-# ------------------------- Konflikter ------------------------
+    page = rows[:limit]
+    return {
+        'rows': [_audit_entry(r) for r in page],
+        'next': str(page[-1]['LogID']) if len(rows) > limit else None,
+    }
 
-@app.route('/api/issues')
-@login_required
-def api_issues():
-    engine = get_connection()
+def _audit_filters(args):
+    """WHERE fragments for the global log: user, action, date range (yyyy-mm-dd)."""
+    where, params = [], {}
 
-    # Pagination
-    try:
-        limit = int(request.args.get('limit', 10))
-    except:
-        limit = 10
+    user = (args.get('user') or '').strip()
+    if user:
+        if '@' in user:
+            where.append("PerformedBy = :user")
+            params['user'] = user
+        else:
+            # initials, e.g. 'ABC' for abc@aarhus.dk (prefix match uses the index)
+            where.append("PerformedBy LIKE :user")
+            params['user'] = user.replace('[', '[[]').replace('%', '[%]').replace('_', '[_]') + '@%'
+
+    action = (args.get('action') or '').strip()
+    if action:
+        if action not in AUDIT_ACTIONS:
+            raise ValueError('Ukendt handling')
+        where.append("ActionType = :action")
+        params['action'] = action
+
+    for key, op in (('date_from', '>='), ('date_to', '<')):
+        raw = (args.get(key) or '').strip()
+        if not raw:
+            continue
+        try:
+            d = datetime.strptime(raw, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError('Ugyldig dato')
+        if key == 'date_to':
+            d += timedelta(days=1)   # inclusive end date
+        where.append(f"PerformedAt {op} :{key}")
+        params[key] = d
+
+    return where, params
+
+@app.route('/api/fakturering/<int:row_id>/history')
+@login_required
+def row_history(row_id):
+    """Audit trail of one fakturalinje, newest first (keyset: ?before=<LogID>)."""
     try:
-        offset = int(request.args.get('offset', 0))
-    except:
-        offset = 0
+        page = audit_page(["RowID = :row_id"], {'row_id': row_id}, request.args)
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    return jsonify(success=True, **page)
 
-    search = (request.args.get('search') or '').strip()
-    status = (request.args.get('status') or '').strip()
-    mine = (request.args.get('mine') or '').lower() == "true"
+@app.route('/api/audit')
+@login_required
+@role_required("Vejmankassen-Admin")
+def api_audit():
+    """Global audit log filtered by user, action and date (keyset: ?before=<LogID>)."""
+    try:
+        where, params = _audit_filters(request.args)
+        page = audit_page(where, params, request.args)
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    return jsonify(success=True, **page)
 
-    # Session user
-    user = session.get("user")
-    user_email = user["email"] if user else None
+# ------------------------- Konflikter ------------------------
+#
+# The table view reads an explicit, narrow projection: IssueDescription and
+# SuggestedFix are cut to ISSUE_PREVIEW_CHARS and read in full from
+# /api/issues/<id> only when a row is expanded. Caseworker initials (the part
+# of CaseworkerEmail before '@') are matched in Python against the distinct
+# caseworker emails, so "mine" and initials search filter on CaseworkerEmail
+# directly instead of computing LEFT(CaseworkerEmail, ...) for every row.
+
+ISSUE_PREVIEW_CHARS = 160
+
+# UI field -> InvoiceIssues column
+ISSUE_SORTABLE_COLUMNS = {
+    'Tilladelsesnr': 'i.TilladelsesNr',
+    'IssueType': 'i.IssueType',
+    'Fakturalinje': 'i.Fakturalinje',
+    'ShortEmail': 'i.CaseworkerEmail',
+    'Status': 'i.Status',
+    'UpdatedAt': 'i.UpdatedAt',
+}
 
-    # Build dynamic filters
-    where_clauses = []
-    params = {}
+ISSUE_SEARCH_COLUMNS = (
+    'i.TilladelsesNr', 'i.IssueType', 'i.Fakturalinje',
+    'i.IssueDescription', 'i.SuggestedFix', 'i.Status',
+)
 
+ISSUE_LIST_SELECT = f"""
+            i.IssueID, i.IssueType, i.Fakturalinje, i.Status,
+            i.CaseID AS VejmanID,
+            i.TilladelsesNr AS Tilladelsesnr,
+            i.CaseworkerEmail, i.UpdatedAt, i.ResolvedBy, i.ResolvedAt,
+            LEFT(i.IssueDescription, {ISSUE_PREVIEW_CHARS}) AS IssueDescription,
+            LEFT(i.SuggestedFix, {ISSUE_PREVIEW_CHARS}) AS SuggestedFix,
+            CASE WHEN LEN(i.IssueDescription) > {ISSUE_PREVIEW_CHARS}
+                   OR LEN(i.SuggestedFix) > {ISSUE_PREVIEW_CHARS}
+                 THEN 1 ELSE 0 END AS Truncated"""
+
+ISSUE_DETAIL_SELECT = """
+            i.IssueID, i.IssueType, i.Fakturalinje, i.Status,
+            i.CaseID AS VejmanID,
+            i.TilladelsesNr AS Tilladelsesnr,
+            i.CaseworkerEmail, i.UpdatedAt, i.ResolvedBy, i.ResolvedAt,
+            i.IssueDescription, i.SuggestedFix"""
+
+# Fields of the linked fakturalinje returned with ?include=row: the line whose
+# ID equals the issue's Fakturalinje and whose Tilladelsesnr matches, else Row = None.
+ISSUE_ROW_SELECT = """
+    v.ID, v.FakturaStatus, v.TotalPris, v.Meter, v.Startdato, v.Slutdato, v.AntalDage, v.PEZUUID
+"""
+
+def issue_linked_rows(conn, issues):
+    """Attach the linked fakturalinje (or None) to each issue dict as 'Row',
+    with one batched lookup for the whole page."""
+    issue_ids = [d['IssueID'] for d in issues]
+    linked = {}
+    if issue_ids:
+        sql = text(f"""
+            SELECT i.IssueID, {ISSUE_ROW_SELECT}
+            FROM dbo.InvoiceIssues i
+            JOIN [dbo].[VejmanFakturering] v
+              ON v.ID = TRY_CAST(i.Fakturalinje AS int)
+             AND v.Tilladelsesnr = i.TilladelsesNr
+            WHERE i.IssueID IN :ids
+        """).bindparams(bindparam('ids', expanding=True))
+        for r in conn.execute(sql, {'ids': issue_ids}).mappings():
+            linked[r['IssueID']] = {
+                'ID': r['ID'],
+                'FakturaStatus': (r['FakturaStatus'] or '').strip(),
+                'TotalPris': fmt_num(r['TotalPris']),
+                'Meter': fmt_num(r['Meter']),
+                'Startdato': fmt_date(r['Startdato']) if r['Startdato'] else '',
+                'Slutdato': fmt_date(r['Slutdato']) if r['Slutdato'] else '',
+                'AntalDage': r['AntalDage'] if r['AntalDage'] is not None else 0,
+                'PEZUUID': _str_or_empty(r['PEZUUID']).strip(),
+            }
+    for d in issues:
+        d['Row'] = linked.get(d['IssueID'])
+    return issues
+
+# Distinct caseworker emails, re-read after each sync (the only source of new issues)
+issue_caseworkers = TTLCache(ttl=3600, maxsize=1)
+
+def _short_email(email):
+    return (email or '').split('@', 1)[0]
+
+def caseworker_emails():
+    synced_at = _latest_sync_at()
+    emails = issue_caseworkers.get(synced_at)
+    if emails is None:
+        engine = get_connection()
+        with engine.begin() as conn:
+            emails = [r[0] for r in conn.execute(text("""
+                SELECT DISTINCT CaseworkerEmail FROM dbo.InvoiceIssues
+                WHERE CaseworkerEmail IS NOT NULL
+            """))]
+        issue_caseworkers.set(synced_at, emails)
+    return emails
+
+def _issue_filters(args, user_email):
+    """WHERE fragments and params for the Konflikter filters (search, status, mine)."""
+    where, params = [], {}
+
+    search = (args.get('search') or '').strip()
     if search:
-        where_clauses.append("""
-            (
-                i.TilladelsesNr LIKE :q OR
-                i.IssueType LIKE :q OR
-                i.Fakturalinje LIKE :q OR
-                i.IssueDescription LIKE :q OR
-                i.SuggestedFix LIKE :q OR
-                i.Status LIKE :q OR
-                LEFT(i.CaseworkerEmail, CHARINDEX('@', i.CaseworkerEmail + '@') - 1) LIKE :q
-            )
-        """)
-        params["q"] = f"%{search}%"
-
-    # Status filter
+        terms = [f"{c} LIKE :q" for c in ISSUE_SEARCH_COLUMNS]
+        params['q'] = f"%{search}%"
+        needle = search.lower()
+        emails = [e for e in caseworker_emails() if needle in _short_email(e).lower()]
+        if emails:
+            terms.append("i.CaseworkerEmail IN :emails")
+            params['emails'] = emails
+        where.append("(" + " OR ".join(terms) + ")")
+
+    status = (args.get('status') or '').strip()
     if status:
-        where_clauses.append("Status = :status")
-        params["status"] = status
+        where.append("i.Status = :status")
+        params['status'] = status
 
-    # My issues only
-    if mine and user_email:
-        where_clauses.append("CaseworkerEmail = :email")
-        params["email"] = user_email
+    if (args.get('mine') or '').lower() == "true" and user_email:
+        where.append("i.CaseworkerEmail = :email")
+        params['email'] = user_email
 
-    where_sql = ""
-    if where_clauses:
-        where_sql = "WHERE " + " AND ".join(where_clauses)
+    return where, params
 
-    # Count total rows
+@lru_cache(maxsize=128)
+def _compile_issue_sql(where, sort_col, order, expand_emails):
+    """(count_sql, data_sql, windowed_sql) for one filter/sort shape."""
+    where_sql = "WHERE " + " AND ".join(where) if where else ""
     count_sql = text(f"""
-    SELECT COUNT(*) AS cnt
-    FROM dbo.InvoiceIssues i
-    {where_sql}
+        SELECT COUNT(*) AS cnt
+        FROM dbo.InvoiceIssues i
+        {where_sql}
     """)
-
-
-    # Data query
     data_sql = text(f"""
-        SELECT
-            i.*,
-            i.CaseID as VejmanID,
-            i.TilladelsesNr as Tilladelsesnr,
-            LEFT(i.CaseworkerEmail, CHARINDEX('@', i.CaseworkerEmail + '@') - 1) AS ShortEmail
+        SELECT{ISSUE_LIST_SELECT}
         FROM dbo.InvoiceIssues i
         {where_sql}
-        ORDER BY i.UpdatedAt DESC
+        ORDER BY {sort_col} {order}, i.IssueID {order}
         OFFSET :offset ROWS
         FETCH NEXT :limit ROWS ONLY
     """)
+    windowed_sql = text(f"""
+        SELECT{ISSUE_LIST_SELECT},
+            COUNT(*) OVER () AS _total
+        FROM dbo.InvoiceIssues i
+        {where_sql}
+        ORDER BY {sort_col} {order}, i.IssueID {order}
+        OFFSET :offset ROWS
+        FETCH NEXT :limit ROWS ONLY
+    """)
+    statements = (count_sql, data_sql, windowed_sql)
+    if expand_emails:
+        statements = tuple(s.bindparams(bindparam('emails', expanding=True)) for s in statements)
+    return statements
+
+def _issue_row(r):
+    d = dict(r._mapping)
+    d.pop('_total', None)
+    d['ShortEmail'] = _short_email(d['CaseworkerEmail'])
+    if 'Truncated' in d:
+        d['Truncated'] = bool(d['Truncated'])
+    return d
 
-    params["offset"] = offset
-    params["limit"] = limit
+@app.route('/api/issues')
+@login_required
+def api_issues():
+    engine = get_connection()
 
-    with engine.begin() as conn:
-        total = conn.execute(count_sql, params).scalar()
-        rows = conn.execute(data_sql, params).mappings().all()
+    # Pagination
+    try:
+        limit = int(request.args.get('limit', 10))
+    except:
+        limit = 10
+    try:
+        offset = int(request.args.get('offset', 0))
+    except:
+        offset = 0
+
+    # Sorting (default: most recently updated first)
+    sort_col = ISSUE_SORTABLE_COLUMNS.get((request.args.get('sort') or '').strip())
+    if sort_col:
+        order = 'DESC' if (request.args.get('order') or '').lower() == 'desc' else 'ASC'
+    else:
+        sort_col, order = 'i.UpdatedAt', 'DESC'
+
+    user = session.get("user")
+    where, params = _issue_filters(request.args, user["email"] if user else None)
+    statements = _compile_issue_sql(tuple(where), sort_col, order, 'emails' in params)
+
+    cache_key = ('issues', tuple(where), tuple(sorted((k, tuple(v) if isinstance(v, list) else v)
+                                                      for k, v in params.items())))
 
-    # Convert RowMapping → dict → JSON-safe
-    out_rows = [dict(r) for r in rows]
+    include = {v.strip() for v in (request.args.get('include') or '').split(',')}
+
+    with engine.begin() as conn:
+        total, rows = fetch_page(conn, statements, params, offset, limit,
+                                 count_mode=_count_mode(request.args), cache_key=cache_key)
+        out_rows = [_issue_row(r) for r in rows]
+        if 'row' in include:
+            issue_linked_rows(conn, out_rows)
 
     return jsonify({
         "total": total,
         "rows": out_rows
     })
 
-
-@csrf.exempt
-@app.post('/api/issues/resolve/<int:issue_id>')
+@app.route('/api/issues/<int:issue_id>')
 @login_required
-@role_required("Vejmankassen-Admin", "Vejmankassen-Sagsbehandler")
-def api_issue_resolve(issue_id):
-    user = session.get("user")
-    if not user:
-        return jsonify(success=False, error="Unauthorized"), 401
-
-    email = user["email"]
+def api_issue_detail(issue_id):
+    """One conflict including the full IssueDescription / SuggestedFix text."""
     engine = get_connection()
+    with engine.begin() as conn:
+        r = conn.execute(text(f"""
+            SELECT{ISSUE_DETAIL_SELECT}
+            FROM dbo.InvoiceIssues i
+            WHERE i.IssueID = :id
+        """), {"id": issue_id}).first()
+        if r is None:
+            return jsonify(success=False, error="Issue not found"), 404
+        d = _issue_row(r)
+        if 'row' in (request.args.get('include') or '').split(','):
+            issue_linked_rows(conn, [d])
+    return jsonify(success=True, data=d)
+
+# ---- Accept / reopen ----
+#
+# Single and bulk accept / reopen share one set-based UPDATE, guarded on the
+# current status (and, for accept, on the issue types that cannot be fixed in
+# Vejman). Every change is recorded in dbo.InvoiceIssuesLog in the same
+# transaction. A bulk filter is first resolved to its IssueIDs, so every
+# matched issue gets a result.
+
+# Issue types a caseworker may accept; all others must be fixed in Vejman
+ISSUE_ACCEPTABLE_TYPES = ("Længde/m2 stemmer ikke", "Antal dage stemmer ikke")
+
+ISSUE_ACTIONS = {
+    # action: (required current status, new status, SET clause)
+    'resolve': ('Open', 'UserAccepted',
+                "Status = 'UserAccepted', ResolvedBy = :email, "
+                "ResolvedAt = GETDATE(), UpdatedAt = GETDATE()"),
+    'unresolve': ('UserAccepted', 'Open',
+                  "Status = 'Open', ResolvedBy = NULL, "
+                  "ResolvedAt = NULL, UpdatedAt = GETDATE()"),
+}
 
-    sql = text("""
-        UPDATE dbo.InvoiceIssues
-        SET
-            Status = 'UserAccepted',
-            ResolvedBy = :email,
-            ResolvedAt = GETDATE(),
-            UpdatedAt = GETDATE()
-        WHERE IssueID = :id AND Status = 'Open'
+ISSUE_LOG_BATCH_ROWS = 400      # 5 parameters per row, below SQL Server's 2100
+
+def insert_issue_log(conn, action, user_email, issue_ids):
+    """One InvoiceIssuesLog entry per changed issue, in `conn`'s transaction."""
+    from_status, to_status, _ = ISSUE_ACTIONS[action]
+    issue_ids = list(issue_ids)
+    for start in range(0, len(issue_ids), ISSUE_LOG_BATCH_ROWS):
+        chunk = issue_ids[start:start + ISSUE_LOG_BATCH_ROWS]
+        values = ", ".join(
+            f"(:IssueID_{n}, :ActionType_{n}, :OldStatus_{n}, :NewStatus_{n}, :PerformedBy_{n})"
+            for n in range(len(chunk))
+        )
+        params = {}
+        for n, issue_id in enumerate(chunk):
+            params.update({
+                f'IssueID_{n}': issue_id, f'ActionType_{n}': action,
+                f'OldStatus_{n}': from_status, f'NewStatus_{n}': to_status,
+                f'PerformedBy_{n}': user_email,
+            })
+        conn.execute(text(f"""
+            INSERT INTO dbo.InvoiceIssuesLog (IssueID, ActionType, OldStatus, NewStatus, PerformedBy)
+            VALUES {values}
+        """), params)
+
+def issue_transition(conn, action, *, user_email, ids):
+    """Apply ISSUE_ACTIONS[action] to `ids` and log it. Returns the changed IssueIDs."""
+    from_status, _, set_clause = ISSUE_ACTIONS[action]
+    where = ["i.Status = :from_status", "i.IssueID IN :ids"]
+    params = {'from_status': from_status, 'email': user_email, 'ids': list(ids)}
+    if action == 'resolve':
+        where.append("i.IssueType IN :types")
+        params['types'] = list(ISSUE_ACCEPTABLE_TYPES)
+
+    stmt = text(f"""
+        SET NOCOUNT ON;
+        UPDATE i
+        SET {set_clause}
+        OUTPUT inserted.IssueID
+        FROM dbo.InvoiceIssues i
+        WHERE {' AND '.join(where)}
     """)
+    stmt = stmt.bindparams(*(bindparam(k, expanding=True) for k in ('types', 'ids') if k in params))
+    changed = [r[0] for r in conn.execute(stmt, params)]
+    insert_issue_log(conn, action, user_email, changed)
+    return changed
+
+def issue_skip_reasons(conn, action, ids):
+    """{IssueID: error} explaining why `ids` were not changed by `action`."""
+    if not ids:
+        return {}
+    from_status = ISSUE_ACTIONS[action][0]
+    stmt = text("""
+        SELECT IssueID, Status, IssueType FROM dbo.InvoiceIssues WHERE IssueID IN :ids
+    """).bindparams(bindparam('ids', expanding=True))
+    current = {r[0]: (r[1], r[2]) for r in conn.execute(stmt, {'ids': list(ids)})}
+    reasons = {}
+    for i in ids:
+        if i not in current:
+            reasons[i] = 'Konflikt ikke fundet'
+        elif current[i][0] != from_status:
+            reasons[i] = f'Konflikten har status {current[i][0]}, forventet {from_status}'
+        else:
+            reasons[i] = 'Konflikten skal rettes i Vejman'
+    return reasons
 
-    with engine.begin() as conn:
-        res = conn.execute(sql, {"email": email, "id": issue_id})
+def _issue_action_done(action, count):
+    list_total_cache.clear()
+    adjust_nav_counts(open_issues=-count if action == 'resolve' else count)
 
-    if res.rowcount == 0:
-        return jsonify(success=False, error="Issue not found or already resolved")
+def _single_issue_action(action, issue_id):
+    email = session["user"]["email"]
+    engine = get_connection()
+    with engine.begin() as conn:
+        changed = issue_transition(conn, action, user_email=email, ids=[issue_id])
+        if not changed:
+            reason = issue_skip_reasons(conn, action, [issue_id])[issue_id]
+    if not changed:
+        return jsonify(success=False, error=reason), 409
 
+    _issue_action_done(action, 1)
     return jsonify(success=True)
 
+@csrf.exempt
+@app.post('/api/issues/resolve/<int:issue_id>')
+@login_required
+@role_required("Vejmankassen-Admin", "Vejmankassen-Sagsbehandler")
+def api_issue_resolve(issue_id):
+    return _single_issue_action('resolve', issue_id)
+
 @csrf.exempt
 @app.post('/api/issues/unresolve/<int:issue_id>')
 @login_required
 @role_required("Vejmankassen-Admin", "Vejmankassen-Sagsbehandler")
 def api_issue_unresolve(issue_id):
-    engine = get_connection()
+    return _single_issue_action('unresolve', issue_id)
 
-    sql = text("""
-        UPDATE dbo.InvoiceIssues
-        SET
-            Status = 'Open',
-            ResolvedBy = NULL,
-            ResolvedAt = NULL,
-            UpdatedAt = GETDATE()
-        WHERE IssueID = :id
-    """)
+# ---- Bulk accept / reopen ----
 
-    with engine.begin() as conn:
-        res = conn.execute(sql, {"id": issue_id})
+def issues_matching(conn, filters, user_email, limit):
+    """[(IssueID, Status, IssueType)] of up to `limit` issues matching the Konflikter filters."""
+    where, params = _issue_filters(filters, user_email)
+    stmt = text(f"""
+        SELECT TOP (:limit) i.IssueID, i.Status, i.IssueType
+        FROM dbo.InvoiceIssues i
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY i.IssueID
+    """)
+    if 'emails' in params:
+        stmt = stmt.bindparams(bindparam('emails', expanding=True))
+    return [tuple(r) for r in conn.execute(stmt, {**params, 'limit': limit})]
 
-    if res.rowcount == 0:
-        return jsonify(success=False, error="Issue not found")
+def _issue_eligible(action, status, issue_type):
+    from_status = ISSUE_ACTIONS[action][0]
+    return status == from_status and (action != 'resolve' or issue_type in ISSUE_ACCEPTABLE_TYPES)
 
-    return jsonify(success=True)
-
-@app.route('/api/nav_counts')
+@csrf.exempt
+@app.post('/api/issues/bulk')
 @login_required
-def api_nav_counts():
-    engine = get_connection()
+@role_required("Vejmankassen-Admin", "Vejmankassen-Sagsbehandler")
+def api_issues_bulk():
+    """
+    Body: {"action": "resolve"|"unresolve", "ids": [..]} or
+          {"action": .., "filter": {"search": .., "status": .., "mine": true}, "expected": n}
+    In filter mode every matching issue (at most BULK_MAX_IDS) is processed,
+    and `expected` must equal the number of them in the action's source status
+    (as returned by the same body with "preview": true); otherwise 409.
+    Returns per-ID outcomes.
+    """
+    data = request.get_json(force=True) or {}
+    action = data.get('action')
+    if action not in ISSUE_ACTIONS:
+        return jsonify(success=False, error='Ukendt handling'), 400
 
-    sql = text("""
-        SELECT
-          (SELECT COUNT(*) FROM VejmanFakturering WHERE FakturaStatus='Ny') AS new_rows,
-          (SELECT COUNT(*) FROM InvoiceIssues WHERE Status='Open') AS open_issues
-    """)
+    ids = data.get('ids')
+    filters = None
+    if ids is not None:
+        try:
+            ids = list(dict.fromkeys(int(i) for i in ids))
+        except (TypeError, ValueError):
+            return jsonify(success=False, error='Ugyldige ID\'er'), 400
+        if not ids:
+            return jsonify(success=False, error='Ingen konflikter valgt'), 400
+        if len(ids) > BULK_MAX_IDS:
+            return jsonify(success=False, error=f'Højst {BULK_MAX_IDS} konflikter ad gangen'), 400
+    elif isinstance(data.get('filter'), dict):
+        f = data['filter']
+        filters = {
+            'search': f.get('search') or '',
+            'status': f.get('status') or '',
+            'mine': 'true' if f.get('mine') in (True, 'true') else '',
+        }
+    else:
+        return jsonify(success=False, error='ids eller filter mangler'), 400
 
+    from_status = ISSUE_ACTIONS[action][0]
+    user_email = session["user"]["email"]
+    engine = get_connection()
     with engine.begin() as conn:
-        row = conn.execute(sql).mappings().first()
+        if filters is not None:
+            matched = issues_matching(conn, filters, user_email, BULK_MAX_IDS + 1)
+            if len(matched) > BULK_MAX_IDS:
+                return jsonify(success=False,
+                               error=f'Filteret matcher over {BULK_MAX_IDS} konflikter; afgræns det'), 400
+            eligible = sum(1 for _, status, issue_type in matched
+                           if _issue_eligible(action, status, issue_type))
+            if data.get('preview'):
+                return jsonify(success=True, matching=eligible, total=len(matched), status=from_status)
+            try:
+                expected = int(data['expected'])
+            except (KeyError, TypeError, ValueError):
+                return jsonify(success=False, error='Bekræft antallet af konflikter (expected mangler)'), 400
+            if expected != eligible:
+                return jsonify(success=False, matching=eligible,
+                               error='Antallet af matchende konflikter har ændret sig. Prøv igen.'), 409
+            ids = [r[0] for r in matched]
+            if not ids:
+                return jsonify(success=True, changed=0, failed=0, results=[])
+
+        changed = issue_transition(conn, action, user_email=user_email, ids=ids)
+        changed_set = set(changed)
+        missing = [i for i in ids if i not in changed_set]
+        reasons = issue_skip_reasons(conn, action, missing)
+
+    if changed:
+        _issue_action_done(action, len(changed))
+
+    results = [{'IssueID': i, 'success': True} for i in changed]
+    results += [{'IssueID': i, 'success': False, 'error': reasons[i]} for i in missing]
+
+    return jsonify(success=True, changed=len(changed), failed=len(missing), results=results)
+
+# ---- Nav counts ----
+#
+# Held in process and adjusted in place by the write endpoints that move rows
+# into or out of 'Ny' and issues into or out of 'Open'. Re-counted after a new
+# sync (VejmanKassenSyncHistory.SyncedAt) and every NAV_COUNTS_MAX_AGE seconds,
+# which also picks up writes from other worker processes.
+
+NAV_COUNTS_MAX_AGE = 300
+
+class NavCounts:
+    def __init__(self):
+        self._counts = None
+        self._synced_at = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._counts = None
+
+    def _build(self):
+        sql = text("""
+            SELECT
+              (SELECT COUNT(*) FROM VejmanFakturering WHERE FakturaStatus='Ny') AS new_rows,
+              (SELECT COUNT(*) FROM InvoiceIssues WHERE Status='Open') AS open_issues
+        """)
+        synced_at = _latest_sync_at()
+        engine = get_connection()
+        with engine.begin() as conn:
+            row = conn.execute(sql).mappings().first()
+        self._counts = dict(row) if row else {'new_rows': 0, 'open_issues': 0}
+        self._synced_at = synced_at
+        self._built_at = time.monotonic()
+
+    def get(self):
+        with self._lock:
+            if self._counts is not None and (
+                    time.monotonic() - self._built_at > NAV_COUNTS_MAX_AGE
+                    or _latest_sync_at() != self._synced_at):
+                self._counts = None
+            if self._counts is None:
+                self._build()
+            return dict(self._counts)
+
+    def adjust(self, new_rows=0, open_issues=0):
+        """Apply a delta from a committed write. No-op until the counts are loaded."""
+        with self._lock:
+            if self._counts is None:
+                return False
+            self._counts['new_rows'] = max(0, self._counts['new_rows'] + new_rows)
+            self._counts['open_issues'] = max(0, self._counts['open_issues'] + open_issues)
+            return True
+
+nav_count_cache = NavCounts()
+
+def nav_counts():
+    """Badge counts for the navbar: new fakturalinjer and open issues."""
+    return nav_count_cache.get()
+
+def adjust_nav_counts(changed_rows=(), open_issues=0):
+    """Update the cached counts after a write and push them to open tabs.
+    `changed_rows` are #changed mappings (OldStatus/NewStatus)."""
+    new_rows = 0
+    for r in changed_rows:
+        new_rows += ((r['NewStatus'] or '').strip() == 'Ny') - ((r['OldStatus'] or '').strip() == 'Ny')
+    if not (new_rows or open_issues):
+        return
+    if nav_count_cache.adjust(new_rows, open_issues):
+        live_hub.publish('counts', nav_counts())
 
-    return jsonify(dict(row) if row else {})
+@app.route('/api/nav_counts')
+@login_required
+def api_nav_counts():
+    return jsonify(nav_counts())
 
 # ------------------------- Statistik -------------------------
 
+# Statistik status checkbox value -> FakturaStatus
+STATUS_BUCKETS = {
+    'faktureret': 'Faktureret',
+    'ikke_faktureret': 'Ny',
+    'sendt_til_fakturering': 'Afsendt',
+    'under_fakturering': 'TilFakturering',
+    'fakturer_ikke': 'FakturerIkke',
+}
+
 def _status_where_fragments(selected_statuses):
     """Map legacy bucket names to FakturaStatus single column.
     Buckets (checkbox values in UI):
@@ -1049,16 +2334,8 @@ def _status_where_fragments(selected_statuses):
     clauses = []
     for s in selected_statuses:
         s = s.strip().lower()
-        if s == 'faktureret':
-            clauses.append("FakturaStatus = 'Faktureret'")
-        elif s == 'ikke_faktureret':
-            clauses.append("FakturaStatus = 'Ny'")
-        elif s == 'sendt_til_fakturering':
-            clauses.append("FakturaStatus = 'Afsendt'")
-        elif s == 'under_fakturering':
-            clauses.append("FakturaStatus = 'TilFakturering'")
-        elif s == 'fakturer_ikke':
-            clauses.append("FakturaStatus = 'FakturerIkke'")
+        if s in STATUS_BUCKETS:
+            clauses.append(f"FakturaStatus = '{STATUS_BUCKETS[s]}'")
     if not clauses:
         return "", {}
     return "(" + " OR ".join(clauses) + ")", {}
@@ -1102,30 +2379,11 @@ def _type_filter(args):
         params[key] = val
     return f"COALESCE(TilladelsesType, '') IN ({', '.join(placeholders)})", params
 
-@app.route('/api/statistik')
-def statistik_data():
-    """Table data for Statistik (filters by status/types/dates, server-side pagination)."""
-    engine = get_connection()
-
-    # Pagination
-    try:
-        limit = int(request.args.get('limit', 10))
-    except Exception:
-        limit = 10
-    try:
-        offset = int(request.args.get('offset', 0))
-    except Exception:
-        offset = 0
-
-    # Search & sort
-    search = (request.args.get('search') or '').strip()
-    sort_ui = (request.args.get('sort') or 'Ansøger').strip()
-    order = (request.args.get('order') or 'asc').upper()
-    order = 'DESC' if order.lower() == 'desc' else 'ASC'
-    sort_col = SORTABLE_COLUMNS.get(sort_ui, 'Ansøger')
-
-    # Filters
-    statuses_raw = (request.args.get('statuses') or '').strip()
+def _statistik_filters(args):
+    """Collect the status/type/date filters shared by the Statistik endpoints.
+    Returns (where_clauses, params); search is handled separately.
+    """
+    statuses_raw = (args.get('statuses') or '').strip()
     selected_statuses = [s for s in statuses_raw.split(',') if s.strip()] if statuses_raw else []
 
     where_clauses = []
@@ -1136,196 +2394,329 @@ def statistik_data():
         where_clauses.append(status_sql)
         params.update(status_params)
 
-    type_sql, type_params = _type_filter(request.args)
+    type_sql, type_params = _type_filter(args)
     if type_sql:
         where_clauses.append(type_sql)
         params.update(type_params)
 
-    date_sqls, date_params = _date_filters(request.args)
+    date_sqls, date_params = _date_filters(args)
     if date_sqls:
         where_clauses.extend(date_sqls)
         params.update(date_params)
 
-    if search:
-        where_clauses.append("""
-            (
-                Ansøger LIKE :q OR
-                FørsteSted LIKE :q OR
-                Tilladelsesnr LIKE :q OR
-                CONVERT(varchar(20), CvrNr) LIKE :q OR
-                TilladelsesType LIKE :q
-            )
-        """)
-        params['q'] = f"%{search}%"
+    return where_clauses, params
 
-    where_all = " AND ".join(where_clauses) if where_clauses else "1=1"
+@app.route('/api/statistik')
+def statistik_data():
+    """Table data for Statistik (filters by status/types/dates, server-side pagination)."""
+    where_clauses, params = _statistik_filters(request.args)
+    return jsonify(run_list_view('statistik', request.args, where_clauses, params))
+
+# ---- Metrics cube ----
+#
+# statistik_metrics answers unsearched filter combinations from an in-process
+# cube pre-aggregated by (FakturaStatus, TilladelsesType, Startdato month,
+# Slutdato month). The cube is rebuilt with one grouped query when a new sync
+# lands, when a write endpoint changes a row in this process
+# (invalidate_row_caches), or after METRICS_CUBE_MAX_AGE as a bound for writes
+# made by other worker processes. Date filters must fall on month boundaries
+# to be answered from the cube; anything else goes to SQL.
+
+METRICS_CUBE_CHECK_INTERVAL = 30
+METRICS_CUBE_MAX_AGE = 300
+
+# FakturaStatus -> key in the metrics "status" breakdown
+METRIC_STATUS_KEYS = {
+    'Faktureret': 'faktureret',
+    'Ny': 'ikke_faktureret',
+    'Afsendt': 'sendt_til_fakturering',
+    'UnderFakturering': 'under_fakturering',
+    'FakturerIkke': 'fakturer_ikke',
+}
 
-    count_sql = text(f"""
-        SELECT COUNT(*) AS cnt
-        FROM [dbo].[VejmanFakturering]
-        WHERE {where_all}
-    """)
+def metrics_payload(cells):
+    """Reduce (status, type, count, total_pris, sum_meter, sum_dage) cells to the
+    /api/statistik/metrics response."""
+    row_count = 0
+    total_pris = sum_meter = sum_dage = Decimal(0)
+    status = {key: [0, Decimal(0)] for key in METRIC_STATUS_KEYS.values()}
+    types = {}
+
+    for st, typ, cnt, pris, meter, dage in cells:
+        row_count += cnt
+        total_pris += pris
+        sum_meter += meter
+        sum_dage += dage
+        key = METRIC_STATUS_KEYS.get(st)
+        if key:
+            status[key][0] += cnt
+            status[key][1] += pris
+        t = types.setdefault(typ, [0, Decimal(0)])
+        t[0] += cnt
+        t[1] += pris
+
+    type_list = sorted(types.items(), key=lambda kv: (kv[1][1], kv[1][0]), reverse=True)
+    return {
+        "totals": {
+            "row_count": int(row_count),
+            "total_pris": float(total_pris),
+            "sum_meter": float(sum_meter),
+            "sum_dage": float(sum_dage),
+        },
+        "status": {key: {"count": int(c), "sum": float(s)} for key, (c, s) in status.items()},
+        "types": [
+            {"TilladelsesType": typ, "count": int(c), "sum": float(s)}
+            for typ, (c, s) in type_list
+        ]
+    }
 
-    data_sql = text(f"""
-        SELECT
-            ID,
-            VejmanID,
-            Ansøger,
-            FørsteSted,
-            Tilladelsesnr,
-            CvrNr,
-            TilladelsesType,
-            Enhedspris,
-            Meter,
-            Startdato,
-            Slutdato,
-            AntalDage,
-            TotalPris,
-            FakturaStatus,
-            PEZUUID
-        FROM [dbo].[VejmanFakturering]
-        WHERE {where_all}
-        ORDER BY {sort_col} {order}
-        OFFSET :offset ROWS
-        FETCH NEXT :limit ROWS ONLY
-    """)
+def _month_key(d):
+    return d.year * 100 + d.month
 
-    with engine.begin() as conn:
-        total = conn.execute(count_sql, params).scalar()
-        rows = conn.execute(data_sql, {**params, 'offset': offset, 'limit': limit}).mappings().all()
+def _cube_date_bounds(args, key_from, key_to):
+    """Return (lo, hi) month keys for a date filter, or False if not month-aligned."""
+    lo = hi = None
+    v_from = (args.get(key_from) or '').strip()
+    v_to = (args.get(key_to) or '').strip()
+    try:
+        if v_from:
+            d = date.fromisoformat(v_from)
+            if d.day != 1:
+                return False
+            lo = _month_key(d)
+        if v_to:
+            d = date.fromisoformat(v_to)
+            if (d + timedelta(days=1)).day != 1:
+                return False
+            hi = _month_key(d)
+    except ValueError:
+        return False
+    return lo, hi
+
+def _num(v):
+    return v if isinstance(v, Decimal) else Decimal(str(v or 0))
+
+class MetricsCube:
+    def __init__(self):
+        self._cells = None
+        self._synced_at = None
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._cells = None
+
+    def _build(self):
+        sql = text("""
+            SELECT
+              FakturaStatus,
+              COALESCE(TilladelsesType, '') AS TilladelsesType,
+              YEAR(Startdato) * 100 + MONTH(Startdato) AS start_month,
+              YEAR(Slutdato) * 100 + MONTH(Slutdato) AS slut_month,
+              COUNT(*) AS row_count,
+              COALESCE(SUM(TotalPris), 0) AS total_pris,
+              COALESCE(SUM(NULLIF(Meter, 0)), 0) AS sum_meter,
+              COALESCE(SUM(NULLIF(AntalDage, 0)), 0) AS sum_dage
+            FROM [dbo].[VejmanFakturering]
+            GROUP BY
+              FakturaStatus,
+              COALESCE(TilladelsesType, ''),
+              YEAR(Startdato) * 100 + MONTH(Startdato),
+              YEAR(Slutdato) * 100 + MONTH(Slutdato)
+        """)
+        synced_at = _latest_sync_at()
+        engine = get_connection()
+        with engine.begin() as conn:
+            rows = conn.execute(sql).all()
+        self._cells = [
+            ((r[0] or '').rstrip(), (r[1] or '').rstrip(), r[2], r[3],
+             int(r[4] or 0), _num(r[5]), _num(r[6]), _num(r[7]))
+            for r in rows
+        ]
+        self._synced_at = synced_at
+        self._built_at = self._checked_at = time.monotonic()
+
+    def _current(self):
+        now = time.monotonic()
+        if self._cells is not None and now - self._built_at > METRICS_CUBE_MAX_AGE:
+            self._cells = None
+        if self._cells is not None and now - self._checked_at > METRICS_CUBE_CHECK_INTERVAL:
+            self._checked_at = now
+            if _latest_sync_at() != self._synced_at:
+                self._cells = None
+        if self._cells is None:
+            self._build()
+        return self._cells
+
+    def payload(self, args):
+        """Metrics for the Statistik filters in `args`, or None if the cube can't answer."""
+        if (args.get('search') or '').strip():
+            return None
+        start = _cube_date_bounds(args, 'start_from', 'start_to')
+        slut = _cube_date_bounds(args, 'slut_from', 'slut_to')
+        if start is False or slut is False:
+            return None
 
-    out = []
-    for r in rows:
-        out.append({
-            'ID': r['ID'],
-            'VejmanID': r['VejmanID'],
-            'Ansøger': r['Ansøger'] or '',
-            'Adresse': r['FørsteSted'] or '',
-            'Tilladelsesnr': r['Tilladelsesnr'] or '',
-            'CvrNr': r['CvrNr'] or '',
-            'TilladelsesType': r['TilladelsesType'] or '',
-            'Enhedspris': fmt_num(r['Enhedspris']),
-            'Meter': fmt_num(r['Meter']),
-            'Startdato': fmt_date(r['Startdato']),
-            'Slutdato': fmt_date(r['Slutdato']),
-            'AntalDage': r['AntalDage'] if r['AntalDage'] is not None else 0,
-            'TotalPris': fmt_num(r['TotalPris']),
-            'FakturaStatus': r['FakturaStatus'] or '',
-            'PEZUUID': str(r.get('PEZUUID') or ''),
-        })
+        statuses_raw = (args.get('statuses') or '').strip()
+        statuses = {STATUS_BUCKETS[s.strip().lower()] for s in statuses_raw.split(',')
+                    if s.strip().lower() in STATUS_BUCKETS}
+        types_raw = (args.get('types') or '').strip()
+        types = {v.strip() for v in types_raw.split(',') if v.strip()}
+
+        def in_range(month, bounds):
+            lo, hi = bounds
+            if lo is None and hi is None:
+                return True
+            if month is None:
+                return False
+            return (lo is None or month >= lo) and (hi is None or month <= hi)
+
+        with self._lock:
+            cells = self._current()
+
+        return metrics_payload(
+            (st, typ, cnt, pris, meter, dage)
+            for st, typ, start_m, slut_m, cnt, pris, meter, dage in cells
+            if (not statuses or st in statuses)
+            and (not types or typ in types)
+            and in_range(start_m, start)
+            and in_range(slut_m, slut)
+        )
+
+metrics_cube = MetricsCube()
 
-    return jsonify({'total': total, 'rows': out})
+def invalidate_row_caches(row_ids=None):
+    """Drop derived data after a write endpoint changed VejmanFakturering rows
+    (`row_ids`, or possibly any row when None)."""
+    list_total_cache.clear()
+    metrics_cube.invalidate()
+    row_cache.invalidate(row_ids)
 
 @app.route('/api/statistik/metrics')
 def statistik_metrics():
     """Aggregated metrics for Statistik dashboard (same filters as /api/statistik)."""
+    try:
+        cached = metrics_cube.payload(request.args)
+    except Exception as e:
+        print("Error reading metrics cube:", e)
+        cached = None
+    if cached is not None:
+        return jsonify(cached)
+
     engine = get_connection()
 
     # Same filters
-    statuses_raw = (request.args.get('statuses') or '').strip()
-    selected_statuses = [s for s in statuses_raw.split(',') if s.strip()] if statuses_raw else []
-    where_clauses = []
-    params = {}
-
-    status_sql, status_params = _status_where_fragments(selected_statuses)
-    if status_sql:
-        where_clauses.append(status_sql)
-        params.update(status_params)
-
-    type_sql, type_params = _type_filter(request.args)
-    if type_sql:
-        where_clauses.append(type_sql)
-        params.update(type_params)
-
-    date_sqls, date_params = _date_filters(request.args)
-    if date_sqls:
-        where_clauses.extend(date_sqls)
-        params.update(date_params)
+    where_clauses, params = _statistik_filters(request.args)
 
     search = (request.args.get('search') or '').strip()
     if search:
-        where_clauses.append("""
-            (
-                Ansøger LIKE :q OR
-                FørsteSted LIKE :q OR
-                Tilladelsesnr LIKE :q OR
-                CONVERT(varchar(20), CvrNr) LIKE :q OR
-                TilladelsesType LIKE :q
-            )
-        """)
-        params['q'] = f"%{search}%"
+        _, search_sql, search_params = search_filter(search, SEARCH_COLUMNS)
+        where_clauses.append(search_sql)
+        params.update(search_params)
 
     where_all = " AND ".join(where_clauses) if where_clauses else "1=1"
 
-    # Overall totals
-    sql_totals = text(f"""
+    # One grouped pass; totals, status breakdown and per-type sums are reduced in Python
+    sql_groups = text(f"""
         SELECT
+          FakturaStatus,
+          COALESCE(TilladelsesType, '') AS TilladelsesType,
           COUNT(*) AS row_count,
           COALESCE(SUM(TotalPris), 0) AS total_pris,
           COALESCE(SUM(NULLIF(Meter, 0)), 0) AS sum_meter,
           COALESCE(SUM(NULLIF(AntalDage, 0)), 0) AS sum_dage
         FROM [dbo].[VejmanFakturering]
         WHERE {where_all}
+        GROUP BY FakturaStatus, COALESCE(TilladelsesType, '')
     """)
 
-    # Status breakdowns via single-column CASE
-    sql_status = text(f"""
-        SELECT
-          SUM(CASE WHEN FakturaStatus = 'Faktureret' THEN 1 ELSE 0 END) AS cnt_faktureret,
-          COALESCE(SUM(CASE WHEN FakturaStatus = 'Faktureret' THEN TotalPris ELSE 0 END), 0) AS sum_faktureret,
-
-          SUM(CASE WHEN FakturaStatus = 'Ny' THEN 1 ELSE 0 END) AS cnt_ikke,
-          COALESCE(SUM(CASE WHEN FakturaStatus = 'Ny' THEN TotalPris ELSE 0 END), 0) AS sum_ikke,
-
-          SUM(CASE WHEN FakturaStatus = 'Afsendt' THEN 1 ELSE 0 END) AS cnt_sendt,
-          COALESCE(SUM(CASE WHEN FakturaStatus = 'Afsendt' THEN TotalPris ELSE 0 END), 0) AS sum_sendt,
-
-          SUM(CASE WHEN FakturaStatus = 'UnderFakturering' THEN 1 ELSE 0 END) AS cnt_under,
-          COALESCE(SUM(CASE WHEN FakturaStatus = 'UnderFakturering' THEN TotalPris ELSE 0 END), 0) AS sum_under,
+    with engine.begin() as conn:
+        rows = conn.execute(with_ids(sql_groups, params), params).all()
+
+    return jsonify(metrics_payload(
+        ((r[0] or '').rstrip(), (r[1] or '').rstrip(), int(r[2] or 0), _num(r[3]), _num(r[4]), _num(r[5]))
+        for r in rows
+    ))
+
+# Time buckets for /api/statistik/timeseries ({col} is the chosen date column)
+TIMESERIES_BUCKETS = {
+    'month': "DATEFROMPARTS(YEAR({col}), MONTH({col}), 1)",
+    # Monday of the ISO week, independent of @@DATEFIRST
+    'week': "DATEADD(day, -((DATEPART(weekday, {col}) + @@DATEFIRST - 2) % 7), CAST({col} AS date))",
+}
+TIMESERIES_DATE_FIELDS = ('Startdato', 'Slutdato', 'FakturaDato')
+TIMESERIES_GROUPS = {
+    'status': 'FakturaStatus',
+    'type': "COALESCE(TilladelsesType, '')",
+}
 
-          SUM(CASE WHEN FakturaStatus = 'FakturerIkke' THEN 1 ELSE 0 END) AS cnt_nej,
-          COALESCE(SUM(CASE WHEN FakturaStatus = 'FakturerIkke' THEN TotalPris ELSE 0 END), 0) AS sum_nej
-        FROM [dbo].[VejmanFakturering]
-        WHERE {where_all}
-    """)
+@app.route('/api/statistik/timeseries')
+def statistik_timeseries():
+    """Per-period counts and sums for Statistik (same filters as /api/statistik).
+    Args: bucket = month|week, date_field = Startdato|Slutdato|FakturaDato,
+    group = comma-separated subset of status,type (default both).
+    """
+    engine = get_connection()
 
-    # Per-type sums
-    sql_types = text(f"""
+    bucket = (request.args.get('bucket') or 'month').strip().lower()
+    if bucket not in TIMESERIES_BUCKETS:
+        bucket = 'month'
+    date_field = (request.args.get('date_field') or 'Startdato').strip()
+    if date_field not in TIMESERIES_DATE_FIELDS:
+        date_field = 'Startdato'
+    group_raw = request.args.get('group')
+    groups = ['status', 'type'] if group_raw is None else [
+        g.strip().lower() for g in group_raw.split(',') if g.strip().lower() in TIMESERIES_GROUPS
+    ]
+
+    where_clauses, params = _statistik_filters(request.args)
+    search = (request.args.get('search') or '').strip()
+    if search:
+        _, search_sql, search_params = search_filter(search, SEARCH_COLUMNS)
+        where_clauses.append(search_sql)
+        params.update(search_params)
+    where_clauses.append(f"{date_field} IS NOT NULL")
+    where_all = " AND ".join(where_clauses)
+
+    period_expr = TIMESERIES_BUCKETS[bucket].format(col=date_field)
+    group_exprs = [TIMESERIES_GROUPS[g] for g in groups]
+    group_select = "".join(f",\n          {expr} AS g{i}" for i, expr in enumerate(group_exprs))
+    group_by = ", ".join([period_expr] + group_exprs)
+
+    sql = text(f"""
         SELECT
-          COALESCE(TilladelsesType, '') AS TilladelsesType,
+          {period_expr} AS period{group_select},
           COUNT(*) AS row_count,
-          COALESCE(SUM(TotalPris), 0) AS total_pris
+          COALESCE(SUM(TotalPris), 0) AS total_pris,
+          COALESCE(SUM(NULLIF(Meter, 0)), 0) AS sum_meter,
+          COALESCE(SUM(NULLIF(AntalDage, 0)), 0) AS sum_dage
         FROM [dbo].[VejmanFakturering]
         WHERE {where_all}
-        GROUP BY COALESCE(TilladelsesType, '')
-        ORDER BY total_pris DESC, row_count DESC
+        GROUP BY {group_by}
+        ORDER BY period
     """)
 
     with engine.begin() as conn:
-        t = conn.execute(sql_totals, params).mappings().first()
-        s = conn.execute(sql_status, params).mappings().first()
-        type_rows = conn.execute(sql_types, params).mappings().all()
+        rows = conn.execute(with_ids(sql, params), params).all()
 
-    payload = {
-        "totals": {
-            "row_count": int(t['row_count'] or 0),
-            "total_pris": float(t['total_pris'] or 0.0),
-            "sum_meter": float(t['sum_meter'] or 0.0),
-            "sum_dage": float(t['sum_dage'] or 0.0),
-        },
-        "status": {
-            "faktureret":         {"count": int(s['cnt_faktureret'] or 0), "sum": float(s['sum_faktureret'] or 0.0)},
-            "ikke_faktureret":    {"count": int(s['cnt_ikke'] or 0),       "sum": float(s['sum_ikke'] or 0.0)},
-            "sendt_til_fakturering":{"count": int(s['cnt_sendt'] or 0),    "sum": float(s['sum_sendt'] or 0.0)},
-            "under_fakturering":  {"count": int(s['cnt_under'] or 0),      "sum": float(s['sum_under'] or 0.0)},
-            "fakturer_ikke":      {"count": int(s['cnt_nej'] or 0),        "sum": float(s['sum_nej'] or 0.0)},
-        },
-        "types": [
-            {"TilladelsesType": r['TilladelsesType'] or '', "count": int(r['row_count'] or 0), "sum": float(r['total_pris'] or 0.0)}
-            for r in type_rows
-        ]
-    }
-    return jsonify(payload)
+    group_keys = {'status': 'FakturaStatus', 'type': 'TilladelsesType'}
+    points = []
+    for r in rows:
+        point = {"period": fmt_date_iso(r[0])}
+        for i, g in enumerate(groups):
+            point[group_keys[g]] = (r[1 + i] or '').rstrip()
+        n = 1 + len(groups)
+        point.update({
+            "count": int(r[n] or 0),
+            "total_pris": float(r[n + 1] or 0.0),
+            "sum_meter": float(r[n + 2] or 0.0),
+            "sum_dage": float(r[n + 3] or 0.0),
+        })
+        points.append(point)
+
+    return jsonify({"bucket": bucket, "date_field": date_field, "group": groups, "points": points})
 
 @app.route('/api/statistik/types')
 def statistik_types():
@@ -1342,47 +2733,555 @@ def statistik_types():
 
 # ------------------------- CSV Export -------------------------
 
+# Columns that may be requested for export; UI names (e.g. 'Adresse') are mapped via LIST_COLUMNS
+EXPORT_COLUMNS = (
+    'ID', 'VejmanID', 'Ansøger', 'FørsteSted', 'Tilladelsesnr', 'CvrNr', 'TilladelsesType',
+    'Enhedspris', 'Meter', 'Startdato', 'Slutdato', 'AntalDage', 'TotalPris', 'FakturaStatus',
+    'FakturaNr', 'VejmanFakturaID', 'ATT', 'FakturaDato', 'Ordrenummer', 'PEZUUID',
+)
+EXPORT_BATCH_ROWS = 2000        # rows fetched per round from the streaming cursor
+EXPORT_CHUNK_SIZE = 256 * 1024  # characters buffered per yielded chunk
+EXPORT_DECIMAL_SCALE = 10       # Arrow/Parquet scale of decimal columns; finer values fail the export
+EXPORT_SCHEMA_ROWS = 10 * EXPORT_BATCH_ROWS  # read-ahead to find a value that types each column
+
+def _export_columns(args):
+    """Requested export columns in request order, or [] for all columns."""
+    columns = []
+    for c in (args.get('columns') or '').split(','):
+        c = c.strip()
+        db_col = LIST_COLUMNS[c][0] if c in LIST_COLUMNS else c
+        if db_col in EXPORT_COLUMNS and db_col not in columns:
+            columns.append(db_col)
+    return columns
+
+def _export_query(args, columns):
+    """SELECT for an export with the Statistik filters (status/types/dates/search)."""
+    where_clauses, params = _statistik_filters(args)
+    search = (args.get('search') or '').strip()
+    if search:
+        _, search_sql, search_params = search_filter(search, SEARCH_COLUMNS)
+        where_clauses.append(search_sql)
+        params.update(search_params)
+    where_all = " AND ".join(where_clauses) if where_clauses else "1=1"
+    select = ", ".join(f"[{c}]" for c in columns) if columns else "*"
+
+    sql = text(f"""
+        SELECT {select}
+        FROM [dbo].[VejmanFakturering]
+        WHERE {where_all}
+        ORDER BY ID
+    """)
+    return with_ids(sql, params), params
+
+def _csv_value(val):
+    if val is None:
+        return ''
+    if isinstance(val, (float, Decimal)):
+        return str(val).replace('.', ',')  # dk decimal
+    return val
+
+def _wants_gzip(args):
+    flag = (args.get('gzip') or '').strip().lower()
+    if flag in ('0', 'false', 'nej', 'no'):
+        return False
+    if flag in ('1', 'true', 'ja', 'yes'):
+        return True
+    return request.accept_encodings['gzip'] > 0
+
+def gzip_stream(chunks):
+    """Gzip a stream of text chunks on the fly."""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = z.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield z.flush()
+
 @app.route('/api/statistik/export-csv')
 def statistik_export_csv():
-    """Stream hele [dbo].[VejmanFakturering] som CSV (dansk format med ';')."""
+    """Stream [dbo].[VejmanFakturering] som CSV (dansk format med ';').
+    Uden argumenter eksporteres hele tabellen. Accepterer samme filtre som
+    /api/statistik samt columns=<kommasepareret liste>; gzip-komprimeres når
+    klienten understøtter det (gzip=0 slår det fra).
+    """
     engine = get_connection()
-    sql = text("SELECT * FROM [dbo].[VejmanFakturering] ORDER BY ID")  # includes FakturaStatus
+    columns = _export_columns(request.args)
+    sql, params = _export_query(request.args, columns)
 
     def generate():
-        yield '\ufeff'  # UTF-8 BOM
+        out = io.StringIO()
+        out.write('\ufeff')  # UTF-8 BOM
+        writer = csv.writer(out, delimiter=';', quoting=csv.QUOTE_MINIMAL)
 
         with engine.connect() as conn:
-            result = conn.execution_options(stream_results=True).execute(sql)
-
-            out = io.StringIO()
-            writer = csv.writer(out, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-
-            headers = list(result.keys())
-            writer.writerow(headers)
-            yield out.getvalue()
-            out.seek(0); out.truncate(0)
-
-            for row in result.mappings():
-                values = []
-                for col in headers:
-                    val = row.get(col)
-                    if val is None:
-                        values.append('')
-                    elif isinstance(val, (float, Decimal)):
-                        values.append(str(val).replace('.', ','))  # dk decimal
-                    else:
-                        values.append(val)
-                writer.writerow(values)
-                yield out.getvalue()
-                out.seek(0); out.truncate(0)
+            result = conn.execution_options(stream_results=True).execute(sql, params)
+            writer.writerow(list(result.keys()))
+
+            for batch in result.partitions(EXPORT_BATCH_ROWS):
+                writer.writerows([_csv_value(v) for v in row] for row in batch)
+                if out.tell() >= EXPORT_CHUNK_SIZE:
+                    yield out.getvalue()
+                    out.seek(0); out.truncate(0)
+
+        yield out.getvalue()
 
     fname = f"VejmanFakturering_{datetime.now().strftime('%Y-%m-%d')}.csv"
+    headers = {'Content-Disposition': f'attachment; filename="{fname}"', 'Vary': 'Accept-Encoding'}
+    body = generate()
+    if _wants_gzip(request.args):
+        headers['Content-Encoding'] = 'gzip'
+        body = gzip_stream(body)
+
     return Response(
-        stream_with_context(generate()),
+        stream_with_context(body),
         mimetype='text/csv; charset=utf-8',
+        headers=headers
+    )
+
+# ------------------------- Columnar Export -------------------------
+#
+# Typed exports for BI (Power BI / Excel): Parquet and Arrow IPC are streamed
+# batch by batch from the stream_results cursor; XLSX is written with
+# XlsxWriter in constant_memory mode to a temp file and then streamed.
+# Column types are taken from the first non-null value in the first batch.
+
+EXPORT_MIMETYPES = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+XLSX_MAX_ROWS = 1048575  # per sheet, excluding the header row
+
+class _ByteSink:
+    """Write-only, non-seekable file object whose written bytes are drained by a generator."""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+def _arrow_type(pa, sample):
+    if isinstance(sample, bool):
+        return pa.bool_()
+    if isinstance(sample, int):
+        return pa.int64()
+    if isinstance(sample, Decimal):
+        # SQL decimal/money columns: one fixed scale, so no value is ever rounded
+        return pa.decimal128(38, EXPORT_DECIMAL_SCALE)
+    if isinstance(sample, float):
+        return pa.float64()
+    if isinstance(sample, datetime):
+        return pa.timestamp('ms')
+    if isinstance(sample, date):
+        return pa.date32()
+    return pa.string()
+
+def _arrow_schema(pa, columns, rows):
+    fields = []
+    for idx, name in enumerate(columns):
+        sample = next((r[idx] for r in rows if r[idx] is not None), None)
+        fields.append(pa.field(name, _arrow_type(pa, sample)))
+    return pa.schema(fields)
+
+_EXACT_DECIMAL = Context(prec=38, traps=[Inexact, InvalidOperation])
+
+def _exact_decimal(v, scale):
+    """`v` with `scale` decimals; raises Inexact rather than rounding it."""
+    d = v if isinstance(v, Decimal) else Decimal(str(v))
+    return d.quantize(Decimal(1).scaleb(-scale), context=_EXACT_DECIMAL)
+
+def _arrow_coerce(pa, values, typ):
+    if pa.types.is_decimal(typ):
+        return [None if v is None else _exact_decimal(v, typ.scale) for v in values]
+    if typ == pa.string():
+        conv = str
+    elif typ == pa.float64():
+        conv = float
+    elif typ == pa.int64():
+        conv = int
+    else:
+        return list(values)
+    out = []
+    for v in values:
+        try:
+            out.append(None if v is None else conv(v))
+        except (TypeError, ValueError):
+            out.append(None)
+    return out
+
+def _arrow_batch(pa, schema, rows):
+    columns = list(zip(*rows))
+    return pa.record_batch(
+        [pa.array(_arrow_coerce(pa, col, f.type), type=f.type) for col, f in zip(columns, schema)],
+        schema=schema,
+    )
+
+def _export_columnar(fmt, sql, params):
+    """Generator producing the export file in `fmt` as byte chunks."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    engine = get_connection()
+    sink = _ByteSink()
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(sql, params)
+        columns = list(result.keys())
+        batches = result.partitions(EXPORT_BATCH_ROWS)
+
+        # Read ahead until every column has a value to take its type from; a
+        # column that stays empty for EXPORT_SCHEMA_ROWS rows is exported as text.
+        head = []
+        untyped = set(range(len(columns)))
+        for batch in batches:
+            head.extend(batch)
+            untyped = {i for i in untyped if all(r[i] is None for r in batch)}
+            if not untyped or len(head) >= EXPORT_SCHEMA_ROWS:
+                break
+
+        schema = _arrow_schema(pa, columns, head)
+        if fmt == 'parquet':
+            writer = pq.ParquetWriter(sink, schema, compression='snappy')
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+
+        for start in range(0, len(head), EXPORT_BATCH_ROWS):
+            writer.write_batch(_arrow_batch(pa, schema, head[start:start + EXPORT_BATCH_ROWS]))
+            yield sink.drain()
+        del head
+        for batch in batches:
+            writer.write_batch(_arrow_batch(pa, schema, batch))
+            yield sink.drain()
+
+        writer.close()
+        yield sink.drain()
+
+def _export_xlsx(sql, params):
+    """Generator producing an .xlsx file; rows go through XlsxWriter's constant_memory mode."""
+    import xlsxwriter
+
+    engine = get_connection()
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        # User-entered text (Ansøger, addresses) must stay text, never a formula or link
+        workbook = xlsxwriter.Workbook(path, {
+            'constant_memory': True,
+            'strings_to_formulas': False,
+            'strings_to_urls': False,
+        })
+        date_fmt = workbook.add_format({'num_format': 'dd-mm-yyyy'})
+        datetime_fmt = workbook.add_format({'num_format': 'dd-mm-yyyy hh:mm:ss'})
+
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(sql, params)
+            columns = list(result.keys())
+            sheet = None
+            sheet_no = 0
+            row_no = XLSX_MAX_ROWS
+
+            for batch in result.partitions(EXPORT_BATCH_ROWS):
+                for row in batch:
+                    if row_no >= XLSX_MAX_ROWS:
+                        sheet_no += 1
+                        sheet = workbook.add_worksheet(f"VejmanFakturering{'' if sheet_no == 1 else sheet_no}")
+                        sheet.write_row(0, 0, columns)
+                        row_no = 0
+                    row_no += 1
+                    for col_no, val in enumerate(row):
+                        if val is None:
+                            continue
+                        if isinstance(val, datetime):
+                            sheet.write_datetime(row_no, col_no, val, datetime_fmt)
+                        elif isinstance(val, date):
+                            sheet.write_datetime(row_no, col_no, datetime(val.year, val.month, val.day), date_fmt)
+                        elif isinstance(val, Decimal):
+                            sheet.write_number(row_no, col_no, float(val))
+                        elif isinstance(val, (bytes, bytearray)):
+                            sheet.write_string(row_no, col_no, val.hex())
+                        elif isinstance(val, str):
+                            sheet.write_string(row_no, col_no, val)
+                        else:
+                            sheet.write(row_no, col_no, val)
+
+            if sheet is None:
+                workbook.add_worksheet('VejmanFakturering').write_row(0, 0, columns)
+
+        workbook.close()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(EXPORT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+@app.route('/api/statistik/export-<any(parquet, arrow, xlsx):fmt>')
+@login_required
+def statistik_export_columnar(fmt):
+    """Typed export (Parquet, Arrow IPC stream or XLSX) with the same filters and
+    columns= argument as /api/statistik/export-csv."""
+    try:
+        if fmt == 'xlsx':
+            import xlsxwriter  # noqa: F401
+        else:
+            import pyarrow  # noqa: F401
+    except ImportError:
+        return jsonify(success=False, error=f"Eksport som {fmt} kræver pyarrow/XlsxWriter på serveren"), 501
+
+    columns = _export_columns(request.args)
+    sql, params = _export_query(request.args, columns)
+    body = _export_xlsx(sql, params) if fmt == 'xlsx' else _export_columnar(fmt, sql, params)
+
+    fname = f"VejmanFakturering_{datetime.now().strftime('%Y-%m-%d')}.{fmt}"
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_MIMETYPES[fmt],
         headers={'Content-Disposition': f'attachment; filename="{fname}"'}
     )
 
+# ------------------------- Shared local state -------------------------
+#
+# Small key/value store in a SQLite file next to the app, shared by every
+# Waitress process on the server and surviving IIS recycles. Writers take
+# SQLite's database lock with BEGIN IMMEDIATE, so a read-check-write inside
+# one transaction is an atomic compare-and-set across processes.
+
+STATE_DB_PATH = os.getenv('VejmanKassenStateDB') or os.path.join(app.root_path, 'vejmankassen_state.sqlite3')
+
+def state_db():
+    conn = sqlite3.connect(STATE_DB_PATH, timeout=10, isolation_level=None)
+    conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    return conn
+
+TRIGGER_COOLDOWN = timedelta(minutes=5)
+_TRIGGER_KEY = 'last_button_press'
+
+class TriggerCooldown:
+    """Last sync trigger time, claimed atomically so only one request per cooldown
+    reaches PyOrchestrator."""
+
+    def last(self):
+        conn = state_db()
+        try:
+            row = conn.execute("SELECT value FROM kv WHERE key = ?", (_TRIGGER_KEY,)).fetchone()
+        finally:
+            conn.close()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def claim(self, now):
+        """Record `now` as the last trigger unless one happened within the cooldown.
+        Returns (claimed, previous)."""
+        conn = state_db()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM kv WHERE key = ?", (_TRIGGER_KEY,)).fetchone()
+            previous = datetime.fromisoformat(row[0]) if row else None
+            if previous and now - previous < TRIGGER_COOLDOWN:
+                conn.execute("ROLLBACK")
+                return False, previous
+            conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                         (_TRIGGER_KEY, now.isoformat()))
+            conn.execute("COMMIT")
+            return True, previous
+        finally:
+            conn.close()
+
+    def release(self, now, previous):
+        """Undo a claim whose trigger call failed, if nobody has claimed since."""
+        conn = state_db()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM kv WHERE key = ?", (_TRIGGER_KEY,)).fetchone()
+            if row and row[0] == now.isoformat():
+                if previous:
+                    conn.execute("UPDATE kv SET value = ? WHERE key = ?",
+                                 (previous.isoformat(), _TRIGGER_KEY))
+                else:
+                    conn.execute("DELETE FROM kv WHERE key = ?", (_TRIGGER_KEY,))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+trigger_cooldown = TriggerCooldown()
+
+# ------------------------- Audit queue -------------------------
+#
+# Optional (VejmanKassenAuditQueue=1). Instead of inserting VejmanFaktureringLog
+# rows inside the user's transaction, write endpoints append the entries to a
+# spool table in the shared state file after their commit, and a background
+# worker moves them to SQL Server in multi-row INSERTs. The spool survives app
+# pool recycles; entries are deleted only after their INSERT has committed, so
+# delivery is at-least-once.
+
+AUDIT_QUEUE_ENABLED = (os.getenv('VejmanKassenAuditQueue') or '').lower() in ('1', 'true', 'ja', 'yes')
+AUDIT_FLUSH_INTERVAL = 2       # seconds between spool checks
+AUDIT_BATCH_ROWS = 150         # 11 parameters per row, below SQL Server's 2100
+AUDIT_CLAIM_TIMEOUT = 120      # seconds before another process may retake claimed entries
+
+def _spool_value(v):
+    if isinstance(v, Decimal):
+        return str(v)
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    return v
+
+def insert_log_entries(conn, entries):
+    """One multi-row INSERT into VejmanFaktureringLog (dicts keyed by LOG_COLUMNS)."""
+    values, params = [], {}
+    for n, entry in enumerate(entries):
+        values.append("(" + ", ".join(f":{c}_{n}" for c in LOG_COLUMNS) + ")")
+        params.update({f"{c}_{n}": entry.get(c) for c in LOG_COLUMNS})
+    conn.execute(text(f"""
+        INSERT INTO VejmanFaktureringLog ({', '.join(LOG_COLUMNS)})
+        VALUES {', '.join(values)}
+    """), params)
+
+class AuditQueue:
+    def __init__(self):
+        self._token = f"{os.getpid()}-{id(self)}"
+        self._wake = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        conn = state_db()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS audit_spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                entry TEXT NOT NULL,
+                claimed_by TEXT,
+                claimed_at REAL
+            )
+        """)
+        return conn
+
+    def record(self, action, user_email, rows):
+        """Spool one log entry per changed row (mappings with ID and the #changed
+        Old*/New* columns). No-op unless the queue is enabled."""
+        if not AUDIT_QUEUE_ENABLED or not rows:
+            return
+        entries = [
+            {'RowID': r['ID'], 'ActionType': action, 'PerformedBy': user_email,
+             **{c: _spool_value(r[c]) for c in LOG_COLUMNS[2:-1]}}
+            for r in rows
+        ]
+        try:
+            conn = self._db()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("INSERT INTO audit_spool (entry) VALUES (?)",
+                                 [(json.dumps(e),) for e in entries])
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # Spool unavailable: don't lose the entries, write them now
+            print("Error spooling audit entries, inserting directly:", e)
+            with get_connection().begin() as db:
+                for i in range(0, len(entries), AUDIT_BATCH_ROWS):
+                    insert_log_entries(db, entries[i:i + AUDIT_BATCH_ROWS])
+            return
+        self.start()
+        self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="audit-flush", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(AUDIT_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                while self.flush():
+                    pass
+            except Exception as e:
+                print("Error flushing audit queue:", e)
+                time.sleep(AUDIT_FLUSH_INTERVAL * 5)
+
+    def _claim(self):
+        now = time.time()
+        conn = self._db()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("""
+                SELECT id, entry FROM audit_spool
+                WHERE claimed_by IS NULL OR claimed_at < ?
+                ORDER BY id
+                LIMIT ?
+            """, (now - AUDIT_CLAIM_TIMEOUT, AUDIT_BATCH_ROWS)).fetchall()
+            conn.executemany("UPDATE audit_spool SET claimed_by = ?, claimed_at = ? WHERE id = ?",
+                             [(self._token, now, r[0]) for r in rows])
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return rows
+
+    def _finish(self, ids, delivered):
+        conn = self._db()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if delivered:
+                conn.executemany("DELETE FROM audit_spool WHERE id = ?", [(i,) for i in ids])
+            else:
+                conn.executemany("UPDATE audit_spool SET claimed_by = NULL WHERE id = ? AND claimed_by = ?",
+                                 [(i, self._token) for i in ids])
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def flush(self):
+        """Move one batch from the spool to VejmanFaktureringLog.
+        Returns True if a full batch was moved (more may be waiting)."""
+        claimed = self._claim()
+        if not claimed:
+            return False
+        ids = [r[0] for r in claimed]
+        try:
+            with get_connection().begin() as conn:
+                insert_log_entries(conn, [json.loads(r[1]) for r in claimed])
+        except Exception:
+            self._finish(ids, delivered=False)
+            raise
+        self._finish(ids, delivered=True)
+        return len(claimed) == AUDIT_BATCH_ROWS
+
+audit_queue = AuditQueue()
+if AUDIT_QUEUE_ENABLED:
+    audit_queue.start()   # deliver entries spooled before a recycle
+
 # ------------------------- Trigger & Sync -------------------------
 
 @csrf.exempt
@@ -1390,33 +3289,32 @@ def statistik_export_csv():
 @login_required
 @role_required("Vejmankassen-Admin", "Vejmankassen-Sagsbehandler", "Vejmankassen-BI")
 def reset_trigger():
-    global last_button_press
     now = datetime.now()
 
-    # Prevent multiple presses within 5 minutes
-    if last_button_press and now - last_button_press < timedelta(minutes=5):
-        remaining_time = 5 - (now - last_button_press).total_seconds() / 60
+    # Prevent multiple presses within 5 minutes, across all worker processes
+    try:
+        claimed, last_press = trigger_cooldown.claim(now)
+    except sqlite3.Error as e:
+        return jsonify(success=False, message=f"Kunne ikke læse synkroniseringsstatus: {e}"), 500
+    if not claimed:
+        remaining_time = (TRIGGER_COOLDOWN - (now - last_press)).total_seconds() / 60
         return jsonify(success=False, message=f"Synkronisering allerede igangsat, vent {round(remaining_time, 1)} minutter"), 403
 
+    triggered = False
     try:
-        api_key = os.getenv("PyOrchestratorAPIKey")
-        if not api_key:
+        if not orchestrator.api_key:
             return jsonify(success=False, message="API-nøgle mangler i miljøvariabler"), 500
 
-        url = "https://pyorchestrator.aarhuskommune.dk/api/trigger"
         payload = {
             "trigger_name": "VejmanKassenWebsiteTrigger",
             "process_status": "IDLE"
         }
-        headers = {
-            "Content-Type": "application/json",
-            "X-API-Key": api_key
-        }
 
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
+        response = orchestrator.post("/trigger", json=payload, timeout=(3.05, 15))
 
         if response.status_code == 200:
-            last_button_press = now
+            triggered = True
+            live_hub.publish('trigger', {'timestamp': now.strftime('%Y-%m-%d %H:%M:%S')})
             return jsonify(success=True, message="Synkronisering igangsat!")
         else:
             return jsonify(success=False, message=f"Fejl fra PyOrchestrator: {response.text}"), response.status_code
@@ -1425,32 +3323,29 @@ def reset_trigger():
         return jsonify(success=False, message=f"Netværksfejl: {str(e)}"), 500
     except Exception as e:
         return jsonify(success=False, message=str(e)), 500
+    finally:
+        if not triggered:
+            try:
+                trigger_cooldown.release(now, last_press)
+            except sqlite3.Error as e:
+                print("Error releasing sync cooldown:", e)
+
+def _last_button_press_payload():
+    last_press = trigger_cooldown.last()
+    return {'timestamp': last_press.strftime('%Y-%m-%d %H:%M:%S') if last_press else None}
 
 @csrf.exempt
 @app.route('/get_last_button_press', methods=['GET'])
 def get_last_button_press():
-    global last_button_press
-    return jsonify(timestamp=last_button_press.strftime('%Y-%m-%d %H:%M:%S') if last_button_press else None)
-
-def get_last_sync_time():
-    """Fetch latest sync timestamp from VejmanKassenSyncHistory."""
     try:
-        engine = get_connection()
-        with engine.begin() as conn:
-            row = conn.execute(text("""
-                SELECT TOP 1 SyncedAt
-                FROM VejmanKassenSyncHistory
-                ORDER BY SyncedAt DESC
-            """)).fetchone()
-
-        if row and row.SyncedAt:
-            return row.SyncedAt.strftime('%d-%m-%Y %H:%M:%S')
+        return jsonify(_last_button_press_payload())
+    except sqlite3.Error as e:
+        print("Error reading sync cooldown:", e)
+        return jsonify(timestamp=None)
 
-        return "Ukendt tidspunkt"
-
-    except Exception as e:
-        print("Error fetching sync time:", e)
-        return "Fejl ved hentning"
+def get_last_sync_time():
+    """Latest sync timestamp from VejmanKassenSyncHistory, formatted for display."""
+    return sync_state.display()
 
 
 @app.route('/api/sync/last', methods=['GET'])
@@ -1472,6 +3367,118 @@ def inject_user_roles():
         "user_is_sags": "Vejmankassen-Sagsbehandler" in groups,
         "user_is_bi": "Vejmankassen-BI" in groups
     }
+
+# ------------------------- Live updates -------------------------
+#
+# /api/events is a Server-Sent Events stream for the navbar. One poller thread
+# per process reads the nav counts and the sync state every LIVE_POLL_INTERVAL
+# seconds and fans changes out to every open tab, instead of each tab polling
+# /api/nav_counts itself. The poller only runs while someone is subscribed.
+# Every stream holds a Waitress thread, so subscribers are capped at half of
+# the process's threads and streams are closed after LIVE_MAX_STREAM_SECONDS;
+# EventSource reconnects by itself.
+
+# Must equal Waitress' --threads (the app cannot read it); 4 is Waitress' default
+WAITRESS_THREADS = int(os.getenv('VejmanKassenThreads') or 4)
+
+LIVE_POLL_INTERVAL = 30          # seconds between count/sync reads
+LIVE_HEARTBEAT = 15              # comment line keeps proxies from timing out
+LIVE_MAX_SUBSCRIBERS = WAITRESS_THREADS // 2   # above this, clients fall back to polling
+LIVE_MAX_STREAM_SECONDS = 600
+LIVE_RETRY_MS = 5000
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class LiveHub:
+    def __init__(self):
+        self._subscribers = set()
+        self._state = {}          # event -> last payload, replayed to new subscribers
+        self._poller = None
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """Return a queue primed with the current state, or None when the hub is full."""
+        q = queue.Queue(maxsize=32)
+        with self._lock:
+            if len(self._subscribers) >= LIVE_MAX_SUBSCRIBERS:
+                return None
+            self._subscribers.add(q)
+            for event, data in self._state.items():
+                q.put_nowait((event, data))
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name="live-poller", daemon=True)
+                self._poller.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data):
+        """Send `data` to every subscriber if it differs from the last `event` payload."""
+        with self._lock:
+            if self._state.get(event) == data:
+                return
+            self._state[event] = data
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                pass   # stalled client; it gets the current state when it reconnects
+
+    def _poll(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._poller = None
+                    return
+            try:
+                self.publish('counts', nav_counts())
+            except Exception as e:
+                print("Error polling nav counts:", e)
+            try:
+                sync_state.refresh()
+            except Exception as e:
+                print("Error polling sync state:", e)
+            self.publish('sync', {'display': sync_state.display()})
+            try:
+                # picks up triggers fired in other worker processes
+                self.publish('trigger', _last_button_press_payload())
+            except sqlite3.Error as e:
+                print("Error polling sync cooldown:", e)
+            time.sleep(LIVE_POLL_INTERVAL)
+
+live_hub = LiveHub()
+
+@app.route('/api/events')
+@login_required
+def api_events():
+    """Server-Sent Events: `counts`, `sync` and `trigger` updates for the navbar."""
+    q = live_hub.subscribe()
+    if q is None:
+        return jsonify(error="For mange åbne forbindelser"), 503
+
+    def generate():
+        deadline = time.monotonic() + LIVE_MAX_STREAM_SECONDS
+        try:
+            yield f"retry: {LIVE_RETRY_MS}\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    event, data = q.get(timeout=LIVE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield _sse(event, data)
+        finally:
+            live_hub.unsubscribe(q)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 JWT_SHARED_SECRET = os.getenv("PYORCHESTRATOR_JWT_SECRET")
 
 @app.route('/login/token')